@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Headless batch orientation of STL files.
+
+All STL files below the given directories are oriented in a pool of worker processes. The result of each file is
+appended as one JSON object per line to the output file, and its path is appended to a journal. An interrupted run
+that is started again with the same output skips the files in the journal, e.g.:
+
+    python BatchOrientation.py catalogue/ --output orientations.jsonl --extended
+"""
+import os
+import sys
+import json
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from MeshTweaker import Tweak  # noqa: E402
+from OrientationCache import to_ranking  # noqa: E402
+from StlReader import load_stl  # noqa: E402
+
+
+def find_stl_files(roots):
+    """Returns the sorted paths of all STL files in the directories, files are returned as they are."""
+    paths = list()
+    for root in roots:
+        if os.path.isfile(root):
+            paths.append(os.path.abspath(root))
+            continue
+        for directory, _, file_names in os.walk(root):
+            paths += [os.path.abspath(os.path.join(directory, name)) for name in file_names
+                      if name.lower().endswith(".stl")]
+    return sorted(paths)
+
+
+def file_signature(path):
+    """Size and modification time of the file, a changed file is oriented again."""
+    status = os.stat(path)
+    return [status.st_size, int(status.st_mtime)]
+
+
+def read_journal(path):
+    """Returns the entries of the journal by path, the last entry of a file wins."""
+    entries = dict()
+    if not os.path.exists(path):
+        return entries
+    with open(path, "r") as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:  # the last line may be incomplete if the run was killed
+                continue
+            entries[entry["path"]] = entry
+    return entries
+
+
+def orient_file(path, kwargs):
+    """Orients a single STL file in a worker process.
+    Returns:
+        the JSON record of the file with the best_5 ranking, the euler parameter and the rotation matrix.
+    """
+    tweak = Tweak(load_stl(path), verbose=False, **kwargs)
+    axis, phi = tweak.euler_parameter
+    return {"path": path, "signature": file_signature(path),
+            "euler_parameter": [[float(x) for x in axis], float(phi)],
+            "matrix": [[float(x) for x in row] for row in tweak.matrix],
+            "unprintability": float(tweak.unprintability),
+            "best_5": to_ranking(tweak.best_5),
+            "stats": tweak.stats.as_dict()}
+
+
+def _orient_file_safely(path, kwargs):
+    try:
+        return orient_file(path, kwargs)
+    except Exception:
+        return {"path": path, "signature": file_signature(path), "error": traceback.format_exc()}
+
+
+def run(paths, output_path, journal_path, processes=None, retry_failed=False, **kwargs):
+    """Orients the files that are not in the journal yet.
+    Args:
+        paths (list): paths of the STL files.
+        output_path (string): JSON Lines file the records are appended to.
+        journal_path (string): journal of the oriented and failed files.
+        processes (int): amount of worker processes, the amount of CPUs by default.
+        retry_failed (bool): orient the files again whose orientation failed in a previous run.
+        kwargs: keyword arguments for Tweak.
+    Returns:
+        the amount of oriented and of failed files.
+    """
+    journal = read_journal(journal_path)
+    pending = list()
+    for path in paths:
+        entry = journal.get(path)
+        if entry is None or entry["signature"] != file_signature(path) or entry["settings"] != kwargs or \
+                (retry_failed and entry["failed"]):
+            pending.append(path)
+    print("{} files, {} already done, {} to orient".format(len(paths), len(paths) - len(pending), len(pending)))
+
+    oriented = failed = 0
+    # the record is written before the journal entry, so an interrupted run repeats a file instead of losing it
+    with open(output_path, "a") as output, open(journal_path, "a") as journal, \
+            ProcessPoolExecutor(max_workers=processes or os.cpu_count() or 1) as executor:
+        futures = [executor.submit(_orient_file_safely, path, kwargs) for path in pending]
+        try:
+            for future in as_completed(futures):
+                record = future.result()
+                if "error" in record:
+                    failed += 1
+                    print("Failed {path}:\n{error}".format(**record))
+                else:
+                    oriented += 1
+                    output.write(json.dumps(record) + "\n")
+                    output.flush()
+                journal.write(json.dumps({"path": record["path"], "signature": record["signature"],
+                                          "settings": kwargs, "failed": "error" in record}) + "\n")
+                journal.flush()
+                print("[{}/{}] {}".format(oriented + failed, len(pending), record["path"]))
+        except KeyboardInterrupt:
+            for future in futures:  # the files that are not started yet are oriented when the run is resumed
+                future.cancel()
+            raise
+    return oriented, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Orient all STL files in the directories in parallel.")
+    parser.add_argument("roots", nargs="+", help="directories that are searched for STL files, or STL files")
+    parser.add_argument("--output", default="orientations.jsonl", help="JSON Lines file of the results")
+    parser.add_argument("--journal", help="journal of the finished files, the output with .journal by default")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, the CPU count by default")
+    parser.add_argument("--extended", action="store_true", help="use the extended mode")
+    parser.add_argument("--min-volume", action="store_true", help="minimize the support volume")
+    parser.add_argument("--exact-contour", action="store_true",
+                        help="measure the bottom contour along the mesh edges in the extended mode")
+    parser.add_argument("--convex-hull", action="store_true",
+                        help="gather the extended candidates from the convex hull, requires scipy")
+    parser.add_argument("--branch-and-bound", action="store_true",
+                        help="skip the orientations that can't be the best one, they are missing in the best_5")
+    parser.add_argument("--sweep-regions", type=int, default=None,
+                        help="also evaluate the best regions of a dense sweep over all directions, e.g. 8")
+    parser.add_argument("--time-budget", type=float, default=None, help="seconds per file")
+    parser.add_argument("--retry-failed", action="store_true", help="orient the files again that failed before")
+    args = parser.parse_args(argv)
+
+    oriented, failed = run(find_stl_files(args.roots), args.output, args.journal or args.output + ".journal",
+                           processes=args.processes, retry_failed=args.retry_failed, extended_mode=args.extended,
+                           min_volume=args.min_volume, time_budget=args.time_budget,
+                           exact_contour=args.exact_contour, convex_hull=args.convex_hull,
+                           branch_and_bound=args.branch_and_bound, sweep_regions=args.sweep_regions)
+    print("Oriented {} files, {} failed".format(oriented, failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,40 +1,271 @@
 from UM.Job import Job
+from UM.Logger import Logger
 from cura.CuraApplication import CuraApplication
-from .MeshTweaker import Tweak
+from .OrientationCache import OrientationCache, mesh_fingerprint, to_ranking
+from . import TweakEngine
 from UM.Math.Quaternion import Quaternion
 from UM.Math.Vector import Vector
 from UM.Scene.SceneNode import SceneNode
 import math
+from time import time
+import numpy as np
+from typing import Callable, Dict, List, Optional
+
+# Share of the progress of a progressive job that is taken by the fast mode, the refinement takes the rest.
+PROGRESSIVE_FAST_SHARE = 10
 
 class CalculateOrientationJob(Job):
-    def __init__(self, nodes, extended_mode = False, message = None):
+    def __init__(self, nodes, extended_mode = False, message = None, cache = None, time_budget = None, rankings = None, progress_callback = None, progressive = False, keys = None, min_volume = None):
         super().__init__()
+        self._created = time()  # The latency of the first orientation is measured from the creation of its job.
+        # The engine is imported in run, so a cold start never blocks the UI thread that creates the job.
+        self._engine = None
         self._message = message
         self._nodes = nodes
-        self._extended_mode = extended_mode
+        # The progressive mode applies the fast result at once and refines it with the extended mode afterwards.
+        self._progressive = progressive
+        self._extended_mode = extended_mode or progressive
+        self._time_budget = time_budget  # Seconds per node, after which the best orientation found so far is used.
+        self._cache = cache  # type: Optional[OrientationCache]
+        # The token is a class of the engine, it is created in run and cancelled there if the job was cancelled earlier.
+        self._cancel_token = None
+        self._cancelled = False
+        # Rankings in the frame of the mesh by node key, they can be shared between jobs, e.g. by the OrientationScheduler.
+        self._rankings = rankings if rankings is not None else {}  # type: Dict[str, list]
+        self._progress_callback = progress_callback  # type: Optional[Callable[[CalculateOrientationJob, float], None]]
+        # The keys of the nodes, if they are known already, e.g. by the OrientationScheduler, with the min_volume
+        # preference they were computed for. Otherwise both are determined in run.
+        self._keys = keys  # type: Optional[Dict[SceneNode, str]]
+        self._min_volume = min_volume  # type: Optional[bool]
 
     def run(self):
+        # The engine is imported on first use, the warm-up of the plugin usually did it already.
+        self._engine = TweakEngine.load()
+        self._cancel_token = self._engine.CancellationToken()
+        if self._cancelled:
+            self._cancel_token.cancel()
+        preferences = CuraApplication.getInstance().getPreferences()
+        min_volume = self._min_volume if self._min_volume is not None else preferences.getValue("OrientationPlugin/min_volume")
+
+        # The rotations are stored before any node is rotated, as the results refer to the transformed vertices.
+        rotations = {node: self._getWorldRotation(node) for node in self._nodes}
+        keys = self._keys if self._keys is not None else {node: self.getNodeKey(node, min_volume, self._extended_mode) for node in self._nodes}
+        # Nodes with identical mesh data are calculated once, the result of the first one is applied to the others.
+        duplicates = {}  # type: Dict[str, List[SceneNode]]
+        nodes = []
         for node in self._nodes:
-            transformed_vertices = node.getMeshDataTransformed().getVertices()
+            ranking = self._lookupRanking(keys[node])
+            if ranking is not None:
+                self._applyRanking(node, ranking, rotations, min_volume)
+            elif keys[node] in duplicates:
+                duplicates[keys[node]].append(node)
+            else:
+                duplicates[keys[node]] = []
+                nodes.append(node)
+
+        if nodes and self._progressive:
+            self._runProgressive(nodes, min_volume, rotations, keys, duplicates)
+            nodes = []
+        elif nodes and preferences.getValue("OrientationPlugin/use_worker_processes") and TweakEngine.load_workers().is_available():
+            remaining = list(nodes)
+            try:
+                self._runInWorkerProcesses(nodes, remaining, min_volume, rotations, keys, duplicates)
+            except self._engine.TweakCancelled:
+                remaining = []
+            except Exception:
+                Logger.logException("w", "Orienting in worker processes failed, continuing with %d of %d objects in the job thread", len(remaining), len(nodes))
+            # The nodes that were oriented by the workers are rotated already, they must not be calculated again.
+            nodes = remaining
+
+        for index, node in enumerate(nodes):
+            transformed_mesh = node.getMeshDataTransformed()
+
+            # Indexed meshes are handed over with their indices, so every unique vertex is projected only once.
+            # The progress of each node is scaled to its share of all nodes.
+            try:
+                result = self._engine.Tweak(transformed_mesh.getVertices(), indices = transformed_mesh.getIndices(), extended_mode = self._extended_mode, verbose=False, min_volume=min_volume, time_budget = self._time_budget,
+                               progress_callback = lambda progress: self.updateProgress((100 * index + progress) / len(nodes)),
+                               stats_callback = lambda stats: self._logStatistics(node, stats.as_dict()), cancel_token = self._cancel_token)
+            except self._engine.TweakCancelled:
+                Logger.log("d", "Orientation cancelled, %d of %d objects have been oriented", index, len(nodes))
+                break
+            self._recordFirstCall()
+            if result.candidates_skipped > 0:
+                Logger.log("d", "Time budget reached, evaluated %d and skipped %d orientations", result.candidates_evaluated, result.candidates_skipped)
+
+            self._finishNode(node, result.euler_parameter, to_ranking(result.best_5), rotations, keys, duplicates, min_volume, complete = result.candidates_skipped == 0)
+
+            Job.yieldThread()
+
+        if self._cache is not None:
+            Logger.log("d", "Orientation cache statistics: %s", self._cache.statistics())
 
-            result = Tweak(transformed_vertices, extended_mode = self._extended_mode, verbose=False, progress_callback=self.updateProgress, min_volume=CuraApplication.getInstance().getPreferences().getValue("OrientationPlugin/min_volume"))
+    def _runProgressive(self, nodes, min_volume, rotations, keys, duplicates):
+        """Applies the fast result of all nodes at once, then refines each node with the extended mode on its already
+        preprocessed mesh. A node is only rotated again if a strictly better orientation is found, and its refinement
+        stops as soon as the user moves or rotates it.
+        """
+        prepared = {}
+        applied = {}  # The world transformations after the fast results were applied, to notice changes by the user.
+        for index, node in enumerate(nodes):
+            transformed_mesh = node.getMeshDataTransformed()
+            try:
+                result = self._engine.Tweak(transformed_mesh.getVertices(), indices = transformed_mesh.getIndices(), extended_mode = False, verbose=False, min_volume=min_volume, keep_mesh = True,
+                               progress_callback = lambda progress: self.updateProgress(PROGRESSIVE_FAST_SHARE * (index + progress / 100) / len(nodes)), cancel_token = self._cancel_token)
+            except self._engine.TweakCancelled:
+                return
+            self._recordFirstCall()
+            ranking = self._toMeshFrame(node, to_ranking(result.best_5), rotations)
+            self._applyEulerParameter(node, result.euler_parameter)
+            for duplicate in duplicates[keys[node]]:
+                self._applyRanking(duplicate, ranking, rotations, min_volume)
+            for moved_node in [node] + duplicates[keys[node]]:
+                applied[moved_node] = moved_node.getWorldTransformation().getData().copy()
+            prepared[node] = (result.prepared_mesh, result.alignment)
+            Job.yieldThread()
 
-            [v, phi] = result.euler_parameter
+        for index, node in enumerate(nodes):
+            mesh, fast_alignment = prepared.pop(node)
+            group = [node] + duplicates[keys[node]]
+            node_token = self._engine.CancellationToken()
 
-            # Convert the new orientation into quaternion
-            new_orientation = Quaternion.fromAngleAxis(phi, Vector(-v[0], -v[1], -v[2]))
-            # Rotate the axis frame.
-            rotation = Quaternion.fromAngleAxis(-0.5 * math.pi, Vector(1, 0, 0))
-            new_orientation = rotation * new_orientation
+            def onProgress(progress):
+                self.updateProgress(PROGRESSIVE_FAST_SHARE + (100 - PROGRESSIVE_FAST_SHARE) * (index + progress / 100) / len(nodes))
+                if self._cancel_token.cancelled or all(self._wasMoved(member, applied) for member in group):
+                    node_token.cancel()
 
-            # Ensure node gets the new orientation
-            node.rotate(new_orientation, SceneNode.TransformSpace.World)
+            try:
+                result = self._engine.Tweak(mesh, extended_mode = True, verbose=False, min_volume=min_volume, time_budget = self._time_budget, progress_callback = onProgress,
+                               stats_callback = lambda stats: self._logStatistics(node, stats.as_dict()), cancel_token = node_token)
+            except self._engine.TweakCancelled:
+                if self._cancel_token.cancelled:
+                    return
+                Logger.log("d", "Refinement of %s stopped, as it was moved", node.getName())
+                continue
+            del mesh
 
+            # The fast result is among the extended candidates, which scores it comparably to the refined ones.
+            fast_unprintability = next((candidate[4] for candidate in result.best_5 if np.array_equal(candidate[0], fast_alignment)), None)
+            ranking = to_ranking(result.best_5)
+            # The refinement runs on the mesh that the fast mode filtered with its larger NEGL_FACE_SIZE, so it is not
+            # the result of an extended search and is kept out of the persistent cache, whose key says "extended".
+            self._storeRanking(node, ranking, rotations, keys, complete = False)
+            if fast_unprintability is None or not result.unprintability < fast_unprintability:
+                continue
+            Logger.log("d", "Refined the orientation of %s, unprintability %.4g instead of %.4g", node.getName(), result.unprintability, fast_unprintability)
+            for member in group:
+                if not self._wasMoved(member, applied):
+                    self._applyRanking(member, ranking, {member: self._getWorldRotation(member)}, min_volume)
             Job.yieldThread()
 
+    @staticmethod
+    def _wasMoved(node, applied):
+        return not np.array_equal(node.getWorldTransformation().getData(), applied[node])
+
+    def _runInWorkerProcesses(self, nodes, remaining, min_volume, rotations, keys, duplicates):
+        """Orients the nodes in parallel worker processes, the job thread only waits for the results.
+
+        :param remaining: The nodes that have not been oriented yet, each node is removed as soon as its result arrives,
+        so it is up to date if the pool fails.
+        """
+        meshes = []
+        for node in nodes:
+            transformed_mesh = node.getMeshDataTransformed()
+            meshes.append((transformed_mesh.getVertices(), transformed_mesh.getIndices()))
+        pool = TweakEngine.load_workers().TweakWorkerPool()
+        for index, euler_parameter, ranking, stats in pool.orient(meshes, cancel_token = self._cancel_token, extended_mode = self._extended_mode, min_volume = min_volume, time_budget = self._time_budget):
+            remaining.remove(nodes[index])
+            self._recordFirstCall()
+            self._logStatistics(nodes[index], stats)
+            self._finishNode(nodes[index], euler_parameter, ranking, rotations, keys, duplicates, min_volume, complete = stats["candidates_skipped"] == 0)
+            self.updateProgress(100 * (len(nodes) - len(remaining)) / len(nodes))
+
+    @staticmethod
+    def getNodeKey(node, min_volume, extended_mode):
+        """Nodes with the same key have identical mesh data and scale, so they share their orientation in the frame of the mesh."""
+        # The untransformed vertices make the key independent of the position and rotation of the node.
+        mesh_data = node.getMeshData()
+        fingerprint = mesh_fingerprint(mesh_data.getVertices(), node.getWorldScale().getData(), indices = mesh_data.getIndices())
+        return OrientationCache.make_key(fingerprint, min_volume, extended_mode)
+
+    def getNodes(self):
+        return self._nodes
+
+    def _lookupRanking(self, key):
+        ranking = self._rankings.get(key)
+        if ranking is None and self._cache is not None:
+            ranking = self._cache.get(key)
+        return ranking
+
+    def _applyRanking(self, node, ranking, rotations, min_volume):
+        # The stored alignment is in the frame of the mesh, rotate it into the world frame.
+        alignment = np.dot(rotations[node], ranking[0][0])
+        parameter = self._engine.PARAMETER_VOL if min_volume else self._engine.PARAMETER
+        rotation_axis, phi, _ = self._engine.calc_euler(alignment, abs(parameter["VECTOR_TOL"]))
+        self._applyEulerParameter(node, [rotation_axis, phi])
+
+    def _finishNode(self, node, euler_parameter, ranking, rotations, keys, duplicates, min_volume, complete = True):
+        self._applyEulerParameter(node, euler_parameter)
+        self._storeRanking(node, ranking, rotations, keys, complete)
+        for duplicate in duplicates[keys[node]]:
+            self._applyRanking(duplicate, ranking, rotations, min_volume)
+
+    @staticmethod
+    def _getWorldRotation(node):
+        return node.getWorldOrientation().toMatrix().getData()[:3, :3]
+
+    @staticmethod
+    def _toMeshFrame(node, ranking, rotations):
+        # Convert the alignments into the frame of the mesh, by applying the inverse rotation of the node.
+        rotation = rotations[node].T
+        for result in ranking:
+            result[0] = [float(x) for x in np.dot(rotation, result[0])]
+        return ranking
+
+    def _storeRanking(self, node, ranking, rotations, keys, complete = True):
+        """Shares the ranking with the other jobs of this run. Only complete rankings are stored in the persistent cache,
+        as the key doesn't contain the time budget: a search that skipped orientations would be used forever instead of
+        the full search."""
+        self._toMeshFrame(node, ranking, rotations)
+        self._rankings[keys[node]] = ranking
+        if self._cache is not None and complete:
+            self._cache.put(keys[node], ranking)
+
+    def _logStatistics(self, node, stats):
+        Logger.log("d", "Orientation statistics of %s: %s", node.getName(), stats)
+
+    def _recordFirstCall(self) -> None:
+        # The first orientation of a session pays the cold start of the engine, unless the plugin warmed it up.
+        if TweakEngine.record_first_call(time() - self._created):
+            Logger.log("d", "First orientation of the session took %.3f s, engine timings: %s", time() - self._created, TweakEngine.timings())
+
+    def _applyEulerParameter(self, node, euler_parameter):
+        [v, phi] = euler_parameter
+
+        # Convert the new orientation into quaternion
+        new_orientation = Quaternion.fromAngleAxis(phi, Vector(-v[0], -v[1], -v[2]))
+        # Rotate the axis frame.
+        rotation = Quaternion.fromAngleAxis(-0.5 * math.pi, Vector(1, 0, 0))
+        new_orientation = rotation * new_orientation
+
+        # Ensure node gets the new orientation
+        node.rotate(new_orientation, SceneNode.TransformSpace.World)
+
+    def cancel(self) -> None:
+        """Stops the calculation, the objects that are already oriented keep their new orientation."""
+        super().cancel()
+        self._cancelled = True
+        if self._cancel_token is not None:
+            self._cancel_token.cancel()
+
+    def isCancelled(self) -> bool:
+        return self._cancelled
+
     def updateProgress(self, progress):
         if self._message:
             self._message.setProgress(progress)
+        if self._progress_callback is not None:
+            self._progress_callback(self, progress)
 
     def getMessage(self):
         return self._message
\ No newline at end of file
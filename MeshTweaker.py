@@ -2,11 +2,23 @@
 import os
 import re
 import math
+import threading
 from time import time, sleep
 from collections import Counter
+from functools import lru_cache
 # upgrade numpy with: "pip install numpy --upgrade"
 import numpy as np
 
+try:
+    from .TweakKernels import project_onto, get_backend
+except ImportError:  # imported outside of the plugin package, e.g. headless
+    from TweakKernels import project_onto, get_backend
+
+try:
+    from scipy.spatial import ConvexHull
+except ImportError:  # scipy is optional, the death star gathers the candidates without it
+    ConvexHull = None
+
 
 # These parameter were minimized by the evolutionary algorithm
 # https://github.com/ChristophSchranz/Tweaker-3_optimize-using-ea, branch ea-optimize_20200414' on 100 objects
@@ -54,6 +66,510 @@ PARAMETER_VOL = {
     "height_log_k": 0.3933594673063997
 }
 
+# Parameters that are only used by the target function, the other ones change the features of the orientations
+TARGET_PARAMETERS = ("TAR_A", "TAR_B", "TAR_C", "TAR_D", "TAR_E", "RELATIVE_F", "CONTOUR_F", "BOTTOM_F")
+# Upper bound in bytes for the N x K intermediates that are allocated while evaluating a block of K orientations
+MEMORY_BUDGET = 256 * 2 ** 20
+# Bytes that are allocated per face and orientation in a lithography block, see NumpyKernels.sum_features: up to
+# nine float64 values (the three projected vertices, the alignment, inner and height, and three temporaries of the
+# overhang term) and two boolean masks at once. Measured with tracemalloc, float32 meshes need about half of it.
+# The per-face constants of min_volume and the legacy contour are not included, they are computed once per mesh and
+# counted separately, see CompactMesh.cache_face_constants
+BYTES_PER_PROJECTION = 9 * 8 + 2
+# Maximal amount of orientations per lithography block if a time budget is set, so the deadline is checked often
+DEADLINE_BLOCK_SIZE = 4
+# Maximal amount of orientations per block of the branch and bound lithography, as only whole blocks are pruned
+BOUND_BLOCK_SIZE = 4
+# Amount of orientations per block if a single orientation exceeds the memory budget, the faces are then
+# evaluated in chunks, whose size is chosen such that the block stays within the budget
+CHUNKED_BLOCK_SIZE = 8
+# Amount of random faces that are drawn by the death star sampler, and how many of them are drawn at once
+DEATH_STAR_SAMPLES = 20000
+DEATH_STAR_CHUNK_SIZE = 4096
+# Maximal amount of faces that are preprocessed at once, and the approximate amount of bytes allocated per face
+PREPROCESS_CHUNK_SIZE = 2 ** 20
+BYTES_PER_PREPROCESSED_FACE = 512
+# Progress in percent at the end of each phase, the death star and the lithography report it per chunk
+PROGRESS_PREPROCESSING = 10
+PROGRESS_AREA_CUMULATION = 15
+PROGRESS_DEATH_STAR = 25
+PROGRESS_LITHOGRAPHY = 95
+# The sphere sweep estimates the overhang of the directions of a geodesic grid from a histogram of the normals on a
+# coarser one, the normals are assigned to its bins by a lookup table on the cells of a cube map
+SWEEP_SUBDIVISIONS = 4  # 2562 directions about 4 degrees apart
+SWEEP_HISTOGRAM_SUBDIVISIONS = 3  # 642 bins about 8 degrees apart
+SWEEP_LOOKUP_RESOLUTION = 64  # cells per edge of each side of the cube map
+SWEEP_CHUNK_SIZE = 256  # directions that are estimated at once
+# Minimal angle in degrees between the picked directions, and up to which a downward normal is assumed to rest on
+# the build plate instead of overhanging
+SWEEP_SEPARATION = 15
+SWEEP_BOTTOM_ANGLE = 5
+
+
+def calc_euler(alignment, vector_tol):
+    """Calculating euler rotation parameters and rotational matrix for an alignment.
+    Args:
+        alignment (np.array): the orientation vector that should point upwards.
+        vector_tol (float): tolerance for alignments that are (anti-)parallel to the z-axis.
+    Returns:
+        rotation axis, rotation angle, rotational matrix.
+    """
+    if np.allclose(alignment, np.array([0, 0, -1]), atol=vector_tol):
+        rotation_axis = [1, 0, 0]
+        phi = np.pi
+    elif np.allclose(alignment, np.array([0, 0, 1]), atol=vector_tol):
+        rotation_axis = [1, 0, 0]
+        phi = 0
+    else:
+        phi = np.pi - np.arccos(-alignment[2])
+        rotation_axis = [-alignment[1], alignment[0], 0]  # the z-axis is fixed to 0 for this rotation
+        rotation_axis = [i / np.linalg.norm(rotation_axis) for i in rotation_axis]  # normalization
+
+    v = rotation_axis
+    rotational_matrix = np.array([[v[0] * v[0] * (1 - math.cos(phi)) + math.cos(phi),
+                                   v[0] * v[1] * (1 - math.cos(phi)) - v[2] * math.sin(phi),
+                                   v[0] * v[2] * (1 - math.cos(phi)) + v[1] * math.sin(phi)],
+                                  [v[1] * v[0] * (1 - math.cos(phi)) + v[2] * math.sin(phi),
+                                   v[1] * v[1] * (1 - math.cos(phi)) + math.cos(phi),
+                                   v[1] * v[2] * (1 - math.cos(phi)) - v[0] * math.sin(phi)],
+                                  [v[2] * v[0] * (1 - math.cos(phi)) - v[1] * math.sin(phi),
+                                   v[2] * v[1] * (1 - math.cos(phi)) + v[0] * math.sin(phi),
+                                   v[2] * v[2] * (1 - math.cos(phi)) + math.cos(phi)]], dtype=np.float64)
+    # rotational_matrix = np.around(rotational_matrix, decimals=6)
+    return rotation_axis, phi, rotational_matrix
+
+
+def geodesic_sphere(subdivisions):
+    """Returns the vertices of an icosahedron whose faces are split into four, subdivisions times, projected onto
+    the unit sphere. Neighbouring vertices are about 63 / 2 ** subdivisions degrees apart.
+    Args:
+        subdivisions (int): amount of subdivisions.
+    Returns:
+        vertices (np.array): unit vectors with format (10 * 4 ** subdivisions + 2) x 3.
+    """
+    phi = (1 + 5 ** 0.5) / 2
+    vertices = np.array([[-1, phi, 0], [1, phi, 0], [-1, -phi, 0], [1, -phi, 0], [0, -1, phi], [0, 1, phi],
+                         [0, -1, -phi], [0, 1, -phi], [phi, 0, -1], [phi, 0, 1], [-phi, 0, -1], [-phi, 0, 1]])
+    vertices /= np.sqrt(np.sum(np.square(vertices), axis=1, keepdims=True))
+    faces = np.array([[0, 11, 5], [0, 5, 1], [0, 1, 7], [0, 7, 10], [0, 10, 11], [1, 5, 9], [5, 11, 4], [11, 10, 2],
+                      [10, 7, 6], [7, 1, 8], [3, 9, 4], [3, 4, 2], [3, 2, 6], [3, 6, 8], [3, 8, 9], [4, 9, 5],
+                      [2, 4, 11], [6, 2, 10], [8, 6, 7], [9, 8, 1]])
+    for _ in range(subdivisions):
+        # each edge gets a vertex at its midpoint, which is shared by the two faces of the edge
+        edges = np.sort(np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]]), axis=1)
+        keys, midpoints = np.unique(edges[:, 0] * len(vertices) + edges[:, 1], return_inverse=True)
+        centres = vertices[keys // len(vertices)] + vertices[keys % len(vertices)]
+        first, second, third = faces.T
+        first_second, second_third, third_first = midpoints.reshape(3, -1) + len(vertices)
+        faces = np.concatenate([np.stack(face, axis=1) for face in ((first, first_second, third_first),
+                                                                    (first_second, second, second_third),
+                                                                    (third_first, second_third, third),
+                                                                    (first_second, second_third, third_first))])
+        vertices = np.concatenate([vertices, centres / np.sqrt(np.sum(np.square(centres), axis=1, keepdims=True))])
+    return vertices
+
+
+def cube_map_cells(vectors, resolution):
+    """Returns the cell of a cube map with resolution x resolution cells per side that each vector points into.
+    Args:
+        vectors (np.array): with format N x 3, they don't need to be normalized.
+        resolution (int): amount of cells per edge of a side.
+    Returns:
+        cells (np.array): with format N and values below 6 * resolution ** 2.
+    """
+    rows = np.arange(len(vectors))
+    axes = np.argmax(np.abs(vectors), axis=1)
+    major = vectors[rows, axes]
+    scale = resolution / 2 / np.where(major == 0, 1, np.abs(major))
+    first = np.clip(((vectors[rows, (axes + 1) % 3] * scale) + resolution / 2).astype(np.intp), 0, resolution - 1)
+    second = np.clip(((vectors[rows, (axes + 2) % 3] * scale) + resolution / 2).astype(np.intp), 0, resolution - 1)
+    return ((2 * axes + (major < 0)) * resolution + first) * resolution + second
+
+
+@lru_cache(maxsize=None)
+def geodesic_lookup(subdivisions, resolution):
+    """Returns the vertices of the geodesic sphere and a read-only table that maps each cell of a cube map, see
+    cube_map_cells, to the vertex nearest to its centre. It is built once per arguments.
+    """
+    vertices = geodesic_sphere(subdivisions)
+    centres = (np.arange(resolution) + 0.5) * 2 / resolution - 1
+    cells = np.empty((6, resolution, resolution, 3))
+    for axis in range(3):
+        for sign in (0, 1):
+            side = cells[2 * axis + sign]
+            side[..., axis] = -1 if sign else 1
+            side[..., (axis + 1) % 3] = centres[:, None]
+            side[..., (axis + 2) % 3] = centres[None, :]
+    cells = cells.reshape(-1, 3)
+    cells /= np.sqrt(np.sum(np.square(cells), axis=1, keepdims=True))
+    # the cells are assigned in small chunks, as there are cells x vertices projections
+    table = np.concatenate([np.argmax(project_onto(vertices, cells[start:start + 1024]), axis=1)
+                            for start in range(0, len(cells), 1024)])
+    vertices.flags.writeable = False
+    table.flags.writeable = False
+    return vertices, table
+
+
+def unprintability(features, parameter, min_volume):
+    """Vectorized target function of the Tweaker, see Tweak.target_function.
+    Args:
+        features (np.array): (bottom, overhang, contour) with format ... x 3.
+        parameter (dict or list): a parameter set, or a population of P parameter sets.
+        min_volume (bool): minimize the support material volume or supported surfaces
+    Returns:
+        the unprintability with format ..., or P x ... for a population.
+    """
+    features = np.asarray(features, dtype=np.float64)
+    bottom, overhang, contour = features[..., 0], features[..., 1], features[..., 2]
+    if isinstance(parameter, dict):
+        p = parameter
+    else:  # one row per parameter set, broadcast against the features
+        shape = (len(parameter),) + (1,) * bottom.ndim
+        p = {name: np.array([pars[name] for pars in parameter], dtype=np.float64).reshape(shape)
+             for name in TARGET_PARAMETERS}
+    if min_volume:  # minimize the volume of support material
+        overhang = overhang / 25  # a volume is of higher dimension, so the overhang have to be reduced
+        return (p["TAR_A"] * (overhang + p["TAR_B"]) + p["RELATIVE_F"] * (overhang + p["TAR_C"]) /
+                (p["TAR_D"] + p["CONTOUR_F"] * contour + p["BOTTOM_F"] * bottom + p["TAR_E"] * overhang))
+    return (p["TAR_A"] * (overhang + p["TAR_B"]) + p["RELATIVE_F"] *
+            (overhang + p["TAR_C"]) / (p["TAR_D"] + p["CONTOUR_F"] * contour + p["BOTTOM_F"] * bottom))
+
+
+class CompactMesh:
+    """Struct-of-arrays representation of a preprocessed mesh. Each quantity is stored in its own contiguous
+    array, the scratch space for project_vertices is only allocated when it is used.
+
+    Following attributes of the class are supported:
+    The unit area vectors .normals with format face_count x 3.
+    The .vertices of each face with format face_count x 3 x 3, or for indexed meshes the unique .points with
+     format point_count x 3 and the .faces with format face_count x 3 that index the points.
+    The triangle .areas with format face_count.
+    Optionally the edge topology, see build_edges: the .face_edges with format face_count x 3 that index the
+     unique edges, and the .edge_lengths with format edge_count.
+    Optionally the per-face constants of the lithography, see cache_face_constants: the .centroids with format
+     face_count x 3 and the .contour_lengths, see opposite_edge_lengths, with format face_count x 3.
+    The scratch arrays .projected (face_count x 3), .proj_max and .proj_median (face_count) that hold the
+     vertices projected onto the current orientation.
+    """
+
+    def __init__(self, normals, vertices, areas, points=None, faces=None, face_edges=None, edge_lengths=None):
+        self.normals = np.ascontiguousarray(normals)
+        self.vertices = None if vertices is None else np.ascontiguousarray(vertices)
+        self.areas = np.ascontiguousarray(areas)
+        self.points = None if points is None else np.ascontiguousarray(points)
+        self.faces = None if faces is None else np.ascontiguousarray(faces)
+        self.face_edges = None if face_edges is None else np.ascontiguousarray(face_edges)
+        self.edge_lengths = edge_lengths
+        self.centroids = None
+        self.contour_lengths = None
+        self.projected = None
+        self.proj_max = None
+        self.proj_median = None
+
+    def __len__(self):
+        return len(self.areas)
+
+    @property
+    def indexed(self):
+        return self.faces is not None
+
+    @property
+    def dtype(self):
+        return self.points.dtype if self.indexed else self.vertices.dtype
+
+    @property
+    def nbytes(self):
+        """Total size of the stored arrays in bytes."""
+        return sum(array.nbytes for array in (self.normals, self.vertices, self.areas, self.points, self.faces,
+                                              self.face_edges, self.edge_lengths, self.centroids,
+                                              self.contour_lengths, self.projected, self.proj_max,
+                                              self.proj_median) if array is not None)
+
+    def take(self, indices):
+        """Returns a new mesh with the selected faces. Scratch space is not copied, points and edges are shared.
+        Args:
+            indices (np.array): boolean mask or indices of the faces to keep.
+        Returns:
+            mesh (CompactMesh): the selected faces.
+        """
+        face_edges = None if self.face_edges is None else self.face_edges[indices]
+        if self.indexed:
+            mesh = CompactMesh(self.normals[indices], None, self.areas[indices], points=self.points,
+                               faces=self.faces[indices], face_edges=face_edges, edge_lengths=self.edge_lengths)
+        else:
+            mesh = CompactMesh(self.normals[indices], self.vertices[indices], self.areas[indices],
+                               face_edges=face_edges, edge_lengths=self.edge_lengths)
+        mesh.centroids = None if self.centroids is None else self.centroids[indices]
+        mesh.contour_lengths = None if self.contour_lengths is None else self.contour_lengths[indices]
+        return mesh
+
+    def face_vertices(self, indices=None):
+        """Returns the vertices of the faces, indexed meshes gather them from the points.
+        Args:
+            indices (np.array): optional boolean mask or indices of the faces.
+        Returns:
+            vertices (np.array): with format face_count x 3 x 3.
+        """
+        if self.indexed:
+            return self.points[self.faces if indices is None else self.faces[indices]]
+        return self.vertices if indices is None else self.vertices[indices]
+
+    def project(self, orientations):
+        """Projects the vertices of each face onto one or several orientations. Indexed meshes project each
+        unique point only once and gather the projections per face, which gives the same values.
+        Args:
+            orientations (np.array): with format 3 or K x 3.
+        Returns:
+            the projections with format face_count x 3 or K x face_count x 3.
+        """
+        if self.indexed:
+            return np.take(project_onto(self.points, orientations), self.faces, axis=-1)
+        return project_onto(self.vertices, orientations)
+
+    def sample(self, face_count):
+        """Returns a level-of-detail version of the mesh with about face_count faces. The faces are drawn by
+        systematic area-weighted sampling, so large faces are kept and each drawn face gets the area it
+        represents. The total area is preserved and the result is deterministic.
+        Args:
+            face_count (int): amount of samples.
+        Returns:
+            mesh (CompactMesh): the sampled faces with adjusted areas.
+        """
+        cumulated = np.cumsum(self.areas, dtype=np.float64)
+        step = cumulated[-1] / face_count
+        picked = np.searchsorted(cumulated, (np.arange(face_count) + 0.5) * step)
+        faces, counts = np.unique(np.minimum(picked, len(self) - 1), return_counts=True)
+        sample = self.take(faces)
+        sample.areas = (counts * step).astype(self.areas.dtype)
+        return sample
+
+    def welded_points(self):
+        """Welds the corners of the faces by their coordinates, hence faces of non-indexed meshes and duplicated
+        points of indexed meshes are connected.
+        Returns:
+            the unique points with format point_count x 3 and the corners of the faces with format face_count x 3
+            that index them.
+        """
+        coordinates = self.points if self.indexed else self.vertices.reshape(-1, 3)
+        # each point is viewed as a single opaque value, which is faster to sort than rows, -0.0 becomes 0.0
+        coordinates = np.ascontiguousarray(coordinates + 0.)
+        keys = coordinates.view(np.dtype((np.void, 3 * coordinates.itemsize))).reshape(-1)
+        _, first_index, welded = np.unique(keys, return_index=True, return_inverse=True)
+        welded = welded.reshape(-1)
+        return coordinates[first_index], welded[self.faces] if self.indexed else welded.reshape(-1, 3)
+
+    def build_edges(self):
+        """Builds the edge topology of the faces once, so that the exact contour of any set of faces is a cheap
+        count per edge. The corners are welded, see welded_points. Each face references its three unique edges in
+        .face_edges, an edge that is shared by two faces appears in the rows of both.
+        """
+        points, corners = self.welded_points()
+        first = corners.astype(np.int64)
+        second = first[:, [1, 2, 0]]
+        # an edge is identified by its two points in ascending order, encoded in a single integer
+        keys = np.minimum(first, second) * len(points) + np.maximum(first, second)
+        edges, face_edges = np.unique(keys, return_inverse=True)
+        ends = points.astype(np.float64)[np.stack([edges // len(points), edges % len(points)], axis=1)]
+        self.face_edges = face_edges.reshape(-1, 3)
+        self.edge_lengths = np.sqrt(np.sum(np.square(ends[:, 0] - ends[:, 1]), axis=-1))
+
+    def boundary_length(self, selected):
+        """Returns the length of the boundary of the selected faces, that is of the edges with exactly one
+        selected incident face. Requires the edge topology, see build_edges.
+        Args:
+            selected (np.array): boolean mask of the faces, e.g. the bottom faces.
+        Returns:
+            the length of the boundary.
+        """
+        return self.boundary_length_of(self.face_edges[selected])
+
+    def boundary_length_of(self, face_edges):
+        """Returns the length of the edges that occur exactly once in the face_edges of the selected faces, e.g.
+        gathered chunk by chunk. The work and memory only depend on the amount of selected faces."""
+        edges, counts = np.unique(face_edges, return_counts=True)
+        return np.sum(self.edge_lengths[edges[counts == 1]], dtype=np.float64)
+
+    def face_centroids(self, chunk_size=None):
+        """Returns the mean of the vertices of each face with format face_count x 3, in mesh.dtype. They are cached
+        by cache_face_constants, otherwise the vertices of chunk_size faces are gathered at once."""
+        if self.centroids is not None:
+            return self.centroids
+        return self.map_faces(lambda vertices: vertices.mean(axis=1), chunk_size)
+
+    def opposite_edge_lengths(self, chunk_size=None):
+        """Returns the length of the edge opposite to each corner of the faces with format face_count x 3, in
+        mesh.dtype, e.g. the edge between the two lower corners of a face whose third corner is the highest one.
+        They are cached by cache_face_constants, otherwise the vertices of chunk_size faces are gathered at once."""
+        if self.contour_lengths is not None:
+            return self.contour_lengths
+        return self.map_faces(lambda vertices: np.sum(np.power(vertices[:, [1, 0, 0]] - vertices[:, [2, 2, 1]], 2),
+                                                      axis=-1) ** 0.5, chunk_size)
+
+    def map_faces(self, function, chunk_size=None):
+        """Applies the function to the vertices of chunk_size faces at a time, all faces by default.
+        Args:
+            function: maps vertices with format n x 3 x 3 to values with format n x 3.
+            chunk_size (int): amount of faces whose vertices are gathered at once.
+        Returns:
+            the values of the faces with format face_count x 3, in mesh.dtype.
+        """
+        if chunk_size is None or chunk_size >= len(self):
+            return function(self.face_vertices()).astype(self.dtype, copy=False)
+        values = np.empty((len(self), 3), dtype=self.dtype)
+        for start in range(0, len(self), chunk_size):
+            part = slice(start, start + chunk_size)
+            values[part] = function(self.face_vertices(part))
+        return values
+
+    def cache_face_constants(self, centroids, contour_lengths, chunk_size=None):
+        """Computes the per-face constants that the lithography needs for every orientation once, see
+        face_centroids and opposite_edge_lengths. They are kept like the edge topology and count in nbytes.
+        Args:
+            centroids (bool): cache the centroids, which min_volume needs for the height of the overhangs.
+            contour_lengths (bool): cache the opposite edge lengths, which the legacy contour needs.
+            chunk_size (int): amount of faces whose vertices are gathered at once.
+        """
+        if centroids and self.centroids is None:
+            self.centroids = self.face_centroids(chunk_size)
+        if contour_lengths and self.contour_lengths is None:
+            self.contour_lengths = self.opposite_edge_lengths(chunk_size)
+
+    def face_constant_bytes(self, centroids, contour_lengths):
+        """Returns the bytes per face of the constants that are not cached yet, see cache_face_constants."""
+        values = 3 * ((centroids and self.centroids is None) + (contour_lengths and self.contour_lengths is None))
+        return values * np.dtype(self.dtype).itemsize
+
+    def chunks(self, chunk_size):
+        """Yields the faces in chunks as non-indexed meshes. Indexed meshes gather the vertices of each chunk, so
+        the memory of a chunk doesn't depend on the size of the mesh.
+        Args:
+            chunk_size (int): amount of faces per chunk.
+        """
+        for start in range(0, len(self), chunk_size):
+            part = slice(start, start + chunk_size)
+            yield CompactMesh(self.normals[part], self.face_vertices(part), self.areas[part],
+                              face_edges=None if self.face_edges is None else self.face_edges[part],
+                              edge_lengths=self.edge_lengths)
+
+    def face_extents(self, chunk_size):
+        """Returns the centroid of each face with format face_count x 3, the largest distance of a vertex from it
+        and the perimeter with format face_count, as float64. They bound the projections of the vertices onto any
+        orientation without projecting them, see Tweak.unprintability_bounds.
+        Args:
+            chunk_size (int): amount of faces whose vertices are gathered at once.
+        """
+        centroids = np.empty((len(self), 3))
+        radii = np.empty(len(self))
+        perimeters = np.empty(len(self))
+        for start in range(0, len(self), chunk_size):
+            part = slice(start, start + chunk_size)
+            vertices = self.face_vertices(part).astype(np.float64)
+            centroids[part] = vertices.mean(axis=1)
+            radii[part] = np.sqrt(np.amax(np.sum(np.square(vertices - centroids[part, None]), axis=-1), axis=1))
+            perimeters[part] = np.sum(np.sqrt(np.sum(np.square(vertices - vertices[:, [1, 2, 0]]), axis=-1)), axis=1)
+        return centroids, radii, perimeters
+
+    def normal_histogram(self, subdivisions, chunk_size):
+        """Accumulates the areas of the faces in the bins of a geodesic sphere, see geodesic_lookup, by the
+        direction of their normal. The work is linear in the amount of faces.
+        Args:
+            subdivisions (int): subdivisions of the geodesic sphere.
+            chunk_size (int): amount of faces that are assigned to the bins at once.
+        Returns:
+            the area of each bin with format bin_count, and the area-weighted mean normal of its faces with format
+            bin_count x 3, which is zero for empty bins.
+        """
+        bins, table = geodesic_lookup(subdivisions, SWEEP_LOOKUP_RESOLUTION)
+        areas = np.zeros(len(bins))
+        normals = np.zeros((len(bins), 3))
+        for start in range(0, len(self), chunk_size):
+            part = slice(start, start + chunk_size)
+            indices = table[cube_map_cells(self.normals[part], SWEEP_LOOKUP_RESOLUTION)]
+            weights = self.areas[part].astype(np.float64)
+            areas += np.bincount(indices, weights=weights, minlength=len(bins))
+            for axis in range(3):
+                normals[:, axis] += np.bincount(indices, weights=weights * self.normals[part, axis],
+                                                minlength=len(bins))
+        normals /= np.where(areas > 0, areas, 1)[:, None]
+        return areas, normals
+
+    def allocate_scratch(self):
+        """Allocates the per-orientation scratch arrays, if not already done."""
+        if self.projected is None:
+            self.projected = np.empty((len(self), 3), dtype=self.dtype)
+            self.proj_max = np.empty(len(self), dtype=self.dtype)
+            self.proj_median = np.empty(len(self), dtype=self.dtype)
+
+
+class TweakCancelled(Exception):
+    """Raised by the Tweaker if its cancellation token is cancelled."""
+    pass
+
+
+class CancellationToken:
+    """ Thread-safe flag to cancel a running Tweaker from another thread.
+
+    The Tweaker checks the token between its phases, the chunks of the death star, the blocks of the
+    lithography and the chunks of faces of out-of-core blocks, and raises TweakCancelled after freeing the mesh.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+
+class TweakStats:
+    """ Diagnostics of a run of the Tweaker.
+
+    Following attributes of the class are supported:
+    The wall time of each phase in seconds .phase_times, the death star phase includes the supplements, the
+     sphere sweep and the removal of duplicates.
+    The amount of faces in the content .faces_input, with an area .faces_with_area, and after the NEGL_FACE_SIZE
+     filter .faces_filtered.
+    The amount of candidate orientations per source .candidates (z_axis, area_cumulation, death_star or
+     convex_hull, supplements, sphere_sweep), the .duplicates_removed among them, and the .candidates_evaluated,
+     .candidates_skipped when the time budget is used up, including the top candidates of the coarse-to-fine mode
+     that weren't re-scored on the full mesh, and .candidates_pruned by the branch and bound of the lithography.
+    The size in bytes of the preprocessed mesh .mesh_bytes and of the largest block of projections
+     .peak_block_bytes, and the amount of faces per chunk .chunk_faces if the lithography evaluated the faces
+     in chunks, as a single orientation exceeded the memory budget.
+    The name of the lithography .backend.
+    """
+
+    def __init__(self, backend=None):
+        self.phase_times = dict()
+        self.faces_input = 0
+        self.faces_with_area = 0
+        self.faces_filtered = 0
+        self.candidates = dict()
+        self.duplicates_removed = 0
+        self.candidates_evaluated = 0
+        self.candidates_skipped = 0
+        self.candidates_pruned = 0
+        self.mesh_bytes = 0
+        self.peak_block_bytes = 0
+        self.chunk_faces = None
+        self.backend = backend
+
+    def as_dict(self):
+        """Returns the statistics as a dictionary of plain values, e.g. to serialize or log them."""
+        return {"phase_times": dict(self.phase_times), "faces_input": self.faces_input,
+                "faces_with_area": self.faces_with_area, "faces_filtered": self.faces_filtered,
+                "candidates": dict(self.candidates), "duplicates_removed": self.duplicates_removed,
+                "candidates_evaluated": self.candidates_evaluated, "candidates_skipped": self.candidates_skipped,
+                "candidates_pruned": self.candidates_pruned,
+                "mesh_bytes": self.mesh_bytes, "peak_block_bytes": self.peak_block_bytes,
+                "chunk_faces": self.chunk_faces, "backend": self.backend}
+
+    def __repr__(self):
+        return "TweakStats({})".format(self.as_dict())
+
 
 class Tweak:
     """ The Tweaker is an auto rotate class for 3D objects.
@@ -72,8 +588,16 @@ class Tweak:
      greater than 10, a support structure is suggested.
     """
 
+    # Squared distance between the unit normal of a face and the favoured side below which the face is weighted by
+    # favour_side, 0.1 corresponds to about 18 degrees
+    ANGLE_SCALE = 0.1
+
     def __init__(self, content, extended_mode=False, verbose=True, show_progress=False,
-                 favside=None, min_volume=False, parameter=None,  progress_callback=None):
+                 favside=None, min_volume=False, parameter=None,  progress_callback=None, memory_budget=None,
+                 single_precision=False, indices=None, lod_faces=None, lod_top_k=8, time_budget=None,
+                 death_star_samples=DEATH_STAR_SAMPLES, seed=0, backend=None,
+                 stats_callback=None, cancel_token=None, keep_mesh=False, exact_contour=False, convex_hull=False,
+                 branch_and_bound=False, sweep_regions=None):
         # Load parameters
         if parameter is None:
             if min_volume:
@@ -90,32 +614,74 @@ class Tweak:
             self.OV_H = 1
 
         self.progress_callback = progress_callback
+        self.cancel_token = cancel_token
         self.extended_mode = extended_mode
+        # the extended mode measures the contour as the boundary of the bottom faces instead of per touching face
+        self.exact_contour = exact_contour
+        self.memory_budget = MEMORY_BUDGET if memory_budget is None else memory_budget
+        # float32 halves the memory of the mesh, at the cost of precision. The chosen orientation is the same in the
+        # fast mode and with the exact contour, but not always with the legacy contour of the extended mode: on a
+        # flat bottom of a rotated mesh, its edges between the two lowest corners of each face are picked by rounding
+        self.dtype = np.float32 if single_precision else np.float64
         self.show_progress = show_progress
+        # the kernels of the lithography, a backend name or None selects the fastest available one
+        self.kernels = get_backend(backend) if backend is None or isinstance(backend, str) else backend
+        self.lod = None  # statistics of the coarse-to-fine evaluation, if it is used
+        self.stats = TweakStats(self.kernels.name)
+        self.best_result = None  # the best [orientation, bottom, overhang, contour, unprintability] found so far
         z_axis = -np.array([0, 0, 1], dtype=np.float64)
         orientations = [[z_axis, 0.0]]
 
         # Preprocess the input mesh format.
         t_start = time()
+        # Without a time budget, all orientations are evaluated. Otherwise they are evaluated in order of their
+        # priority, area cumulation first, then death star and supplements, until the deadline is reached.
+        self.deadline = None if time_budget is None else t_start + time_budget
         self._progress = 0  # progress in percent of tweaking
-        self.update_progress(self._progress + 18)
+        self.update_progress(0)
         # Load mesh from file into class variable
-        self.mesh = self.preprocess(content)
+        self.mesh = self.preprocess(content, indices)
+        if extended_mode and exact_contour and self.mesh.face_edges is None:
+            self.mesh.build_edges()
+        # the preprocessed mesh before the favoured side is weighted, it can be passed as content to a new Tweak
+        self.prepared_mesh = self.mesh if keep_mesh else None
 
         # if a favoured side is specified, load it to weight
         if favside:
             self.favour_side(favside)
         t_pre = time()
-        self.update_progress(self._progress + 18)
+        self.check_cancelled()
+        self.update_progress(PROGRESS_PREPROCESSING)
         # Searching promising orientations:
+        self.stats.candidates["z_axis"] = len(orientations)
         orientations += self.area_cumulation(10)
+        self.stats.candidates["area_cumulation"] = len(orientations) - self.stats.candidates["z_axis"]
 
         t_areacum = time()
-        self.update_progress(self._progress + 18)
+        self.check_cancelled()
+        self.update_progress(PROGRESS_AREA_CUMULATION)
         if extended_mode:
-            orientations += self.death_star(12)
-            orientations += self.add_supplements()
-            orientations = self.remove_duplicates(orientations)
+            if not self.deadline_passed():
+                # the faces of the convex hull replace the random faces of the death star, if scipy is installed
+                candidates = self.convex_hull(12) if convex_hull else None
+                if candidates is not None:
+                    self.stats.candidates["convex_hull"] = len(candidates)
+                else:
+                    candidates = self.death_star(12, death_star_samples, seed)
+                    self.stats.candidates["death_star"] = len(candidates)
+                orientations += candidates
+            supplements = self.add_supplements()
+            self.stats.candidates["supplements"] = len(supplements)
+            orientations += supplements
+        if sweep_regions and not self.deadline_passed():
+            # the best regions of a dense sweep over all directions, in either mode
+            candidates = self.sphere_sweep(sweep_regions, min_volume)
+            self.stats.candidates["sphere_sweep"] = len(candidates)
+            orientations += candidates
+        if extended_mode or sweep_regions:
+            unique_orientations = self.remove_duplicates(orientations)
+            self.stats.duplicates_removed = len(orientations) - len(unique_orientations)
+            orientations = unique_orientations
 
         if verbose:
             print("Examine {} orientations:".format(len(orientations)))
@@ -123,29 +689,42 @@ class Tweak:
                   ("Alignment:", "Bottom:", "Overhang:", "Contour:", "Unpr.:"))
 
         t_ds = time()
-        self.update_progress(self._progress + 18)
+        self.check_cancelled()
+        self.update_progress(PROGRESS_DEATH_STAR)
         # Calculate the unprintability for each orientation found in the gathering algorithms
-        results = list()
-        for side in orientations:
-            orientation = -1 * np.array(side[0], dtype=np.float64)
-
-            self.project_vertices(orientation)
-            bottom, overhang, contour = self.calc_overhang(orientation, min_volume=min_volume)
-            unprintability = self.target_function(bottom, overhang, contour, min_volume=min_volume)
-            results.append([orientation, bottom, overhang, contour, unprintability])
-            if verbose:
+        fine_skipped = 0
+        if lod_faces is not None and len(self.mesh) > lod_faces and len(orientations) > lod_top_k:
+            results = self.coarse_to_fine(orientations, min_volume, lod_faces, lod_top_k,
+                                          progress=(PROGRESS_DEATH_STAR, PROGRESS_LITHOGRAPHY))
+            self.candidates_evaluated = self.lod["evaluated"]
+            fine_skipped = self.lod["fine_skipped"]
+        else:
+            # the ranking then only holds the orientations that could be the best one
+            results = self.lithography(orientations, min_volume=min_volume,
+                                       progress=(PROGRESS_DEATH_STAR, PROGRESS_LITHOGRAPHY),
+                                       branch_and_bound=branch_and_bound)
+            self.candidates_evaluated = len(results)
+        self.candidates_skipped = len(orientations) - self.candidates_evaluated - self.stats.candidates_pruned + \
+            fine_skipped
+        self.stats.candidates_evaluated = self.candidates_evaluated
+        self.stats.candidates_skipped = self.candidates_skipped
+        if verbose:
+            for orientation, bottom, overhang, contour, unprintability in results:
                 print("  %-26s %-10.2f%-10.2f%-10.2f%-10.4g "
                       % (str(np.around(orientation, decimals=4)),
                          bottom, overhang, contour, unprintability))
         t_lit = time()
-        self.update_progress(self._progress + 18)
+        self.stats.phase_times = {"preprocessing": t_pre - t_start, "area_cumulation": t_areacum - t_pre,
+                                  "death_star": t_ds - t_areacum, "lithography": t_lit - t_ds,
+                                  "total": t_lit - t_start}
 
         # Remove the mesh structure as soon as it is not used anymore
         del self.mesh
 
         # evaluate the best alignments and calculate the rotation parameters
         results = np.array(results)
-        best_results = list(results[results[:, 4].argsort()])  # [:5]]  # previously, the best 5 alignments were stored
+        # a stable sort keeps ties in the order of the candidates, so pruned and exhaustive runs pick the same one
+        best_results = list(results[results[:, 4].argsort(kind="mergesort")])  # [:5]]  # previously, the best 5 alignments were stored
 
         for i, align in enumerate(best_results):
             best_results[i] = list(best_results[i])
@@ -159,8 +738,17 @@ class Tweak:
     Death Star:       \t{ds:2f} s
     Lithography Time:  \t{lt:2f} s
     Total Time:        \t{tot:2f} s""".format(
-                pre=t_pre - t_start, ac=t_areacum - t_pre, ds=t_ds - t_areacum,
-                lt=t_lit - t_ds, tot=t_lit - t_start))
+                pre=self.stats.phase_times["preprocessing"], ac=self.stats.phase_times["area_cumulation"],
+                ds=self.stats.phase_times["death_star"], lt=self.stats.phase_times["lithography"],
+                tot=self.stats.phase_times["total"]))
+            if self.candidates_skipped > 0:
+                print("Time budget reached after {} orientations, skipped {}".format(self.candidates_evaluated,
+                                                                                      self.candidates_skipped))
+            if self.stats.candidates_pruned > 0:
+                print("Branch and bound pruned {} orientations".format(self.stats.candidates_pruned))
+            if self.lod is not None:
+                print("Coarse-to-fine: {top_k} of {candidates} orientations re-scored on the full mesh after "
+                      "scoring on {faces} faces, saved {time_saved:2f} s".format(**self.lod))
 
         # The list best_5_results is of the form:
         # [[orientation0, bottom_area0, overhang_area0, contour_line_length, unprintability (gives the order),
@@ -176,6 +764,10 @@ class Tweak:
             self.unprintability = best_results[0][4]
             self.best_5 = best_results
 
+        if stats_callback is not None:
+            stats_callback(self.stats)
+        self.update_progress(100)
+
         # Finish with a nice clean newline, as print_progress rewrites updates without advancing below.
         if show_progress:
             print("\n")
@@ -198,61 +790,152 @@ class Tweak:
             return (self.TAR_A * (overhang + self.TAR_B) + self.RELATIVE_F *
                     (overhang + self.TAR_C) / (self.TAR_D + self.CONTOUR_F * contour + self.BOTTOM_F * bottom))
 
-    def preprocess(self, content):
+    def preprocess(self, content, indices=None):
         """The Mesh format gets preprocessed for a better performance and stored into self.mesh
         Args:
-            content (np.array): undefined representation of the mesh
+            content (np.array): undefined representation of the mesh, or the unique vertices if indices are given,
+                or binary STL records with a "vertices" field, e.g. memory-mapped by StlReader.map_binary_stl,
+                plain vertices and records are preprocessed in chunks, see preprocess_chunks,
+                or a CompactMesh that is already preprocessed
+            indices (np.array): optional face_count x 3 indices into the unique vertices
         Returns:
-            mesh (np.array): with format face_count x 6 x 3.
-        """
-        mesh = np.array(content, dtype=np.float64)
-
-        # prefix area vector, if not already done (e.g. in STL format)
-        if mesh.shape[1] == 3:
-            row_number = int(len(content) / 3)
-            mesh = mesh.reshape(row_number, 3, 3)
-            v0 = mesh[:, 0, :]
-            v1 = mesh[:, 1, :]
-            v2 = mesh[:, 2, :]
-            normals = np.cross(np.subtract(v1, v0), np.subtract(v2, v0)) \
-                .reshape(row_number, 1, 3)
-            mesh = np.hstack((normals, mesh))
-
-        # saves the amount of facets
-        face_count = mesh.shape[0]
-
-        # append columns with a_min, area_size
-        addendum = np.zeros((face_count, 2, 3))
-        addendum[:, 0, 0] = mesh[:, 1, 2]
-        addendum[:, 0, 1] = mesh[:, 2, 2]
-        addendum[:, 0, 2] = mesh[:, 3, 2]
-
-        # calc area size
-        addendum[:, 1, 0] = np.sqrt(np.sum(np.square(mesh[:, 0, :]), axis=-1)).reshape(face_count)
-        addendum[:, 1, 1] = np.max(mesh[:, 1:4, 2], axis=1)
-        addendum[:, 1, 2] = np.median(mesh[:, 1:4, 2], axis=1)
-        mesh = np.hstack((mesh, addendum))
-
-        # filter faces without area
-        mesh = mesh[mesh[:, 5, 0] != 0]
-        face_count = mesh.shape[0]
+            mesh (CompactMesh): with face_count unit area vectors, vertices and area sizes.
+        """
+        if isinstance(content, CompactMesh):  # already preprocessed, e.g. the prepared_mesh of another Tweak
+            self.stats.faces_input = self.stats.faces_with_area = self.stats.faces_filtered = len(content)
+            self.stats.mesh_bytes = content.nbytes
+            return content
+        mesh = np.asarray(content)
+        if mesh.dtype.names is not None:
+            return self.preprocess_chunks(mesh["vertices"])
+        if indices is None and mesh.shape[1] == 3:
+            return self.preprocess_chunks(mesh.reshape(-1, 3, 3))
+        points = None
+        faces = None
+
+        # calculate the area vector, if not already done (e.g. in STL format)
+        if indices is not None:
+            faces = np.asarray(indices).reshape(-1, 3)
+            if faces.dtype.kind not in "iu":
+                faces = faces.astype(np.intp)
+            # the vertices of the faces are only gathered chunk by chunk
+            normals = np.empty((len(faces), 3))
+            chunk_size = self.preprocess_chunk_size()
+            for start in range(0, len(faces), chunk_size):
+                normals[start:start + chunk_size] = self.area_vectors(mesh[faces[start:start + chunk_size]])
+            points = mesh.astype(self.dtype, copy=False)
+            vertices = None
+        else:
+            normals = mesh[:, 0, :].astype(np.float64)
+            vertices = mesh[:, 1:4, :]
 
-        # normalise area vector and correct area size
-        mesh[:, 0, :] = mesh[:, 0, :] / mesh[:, 5, 0].reshape(face_count, 1)
-        mesh[:, 5, 0] = mesh[:, 5, 0] / 2  # halve, because areas are triangles and not parallelograms
+        self.stats.faces_input = len(normals)
+        mesh = self.compact_mesh(normals, vertices, points, faces)
+        self.stats.faces_with_area = len(mesh)
 
         # remove small facets (these are essential for contour calculation)
         if self.NEGL_FACE_SIZE > 0:
-            negl_size = [0.1 * x if self.extended_mode else x for x in [self.NEGL_FACE_SIZE]][0]
-            filtered_mesh = mesh[np.where(mesh[:, 5, 0] > negl_size)]
+            filtered_mesh = mesh.take(mesh.areas > self.negligible_face_size())
             if len(filtered_mesh) > 100:
                 mesh = filtered_mesh
 
+        self.stats.faces_filtered = len(mesh)
+        self.stats.mesh_bytes = mesh.nbytes
         sleep(0)  # Yield, so other threads get a bit of breathing space.
         return mesh
 
+    def preprocess_chunks(self, vertices):
+        """Preprocessing the faces in chunks, whose temporaries stay within the memory budget. Only the chunk that
+        is processed is read into memory, so a memory-mapped file is never held as a whole in addition to the mesh.
+        The faces that pass the filters are copied into preallocated arrays, so the mesh is never held twice. These
+        are resident, at 13 values or 104 bytes per face in double and 52 in single precision, while a binary STL
+        file has 50 bytes per face. Hence the preprocessed mesh, and not the file, has to fit into the memory.
+        The stored normals of STL records are not used, as they have unit length and the area sizes need the cross
+        product anyway.
+        Args:
+            vertices (np.array): with format face_count x 3 x 3, e.g. the "vertices" field of STL records.
+        Returns:
+            mesh (CompactMesh): equal to the result of preprocessing all faces at once.
+        """
+        chunk_size = self.preprocess_chunk_size()
+
+        def stream(filter_small):
+            size = len(vertices)
+            mesh = CompactMesh(np.empty((size, 3), dtype=self.dtype), np.empty((size, 3, 3), dtype=self.dtype),
+                               np.empty(size, dtype=self.dtype))
+            count = 0
+            self.stats.faces_with_area = 0
+            for start in range(0, len(vertices), chunk_size):
+                chunk_vertices = vertices[start:start + chunk_size]
+                chunk = self.compact_mesh(self.area_vectors(chunk_vertices), chunk_vertices)
+                self.stats.faces_with_area += len(chunk)
+                if filter_small:
+                    chunk = chunk.take(chunk.areas > self.negligible_face_size())
+                mesh.normals[count:count + len(chunk)] = chunk.normals
+                mesh.vertices[count:count + len(chunk)] = chunk.vertices
+                mesh.areas[count:count + len(chunk)] = chunk.areas
+                count += len(chunk)
+                self.check_cancelled()
+                sleep(0)  # Yield, so other threads get a bit of breathing space.
+            # the unused tail of the arrays is only as large as the filtered faces
+            return mesh.take(slice(0, count))
+
+        self.stats.faces_input = len(vertices)
+        mesh = stream(filter_small=self.NEGL_FACE_SIZE > 0)
+        if self.NEGL_FACE_SIZE > 0 and len(mesh) <= 100:  # small meshes are not filtered
+            mesh = None  # release the preallocated arrays before they are allocated again
+            mesh = stream(filter_small=False)
+        self.stats.faces_filtered = len(mesh)
+        self.stats.mesh_bytes = mesh.nbytes
+        return mesh
+
+    def preprocess_chunk_size(self):
+        """Returns the amount of faces that are preprocessed at once, so their temporaries stay within the budget."""
+        return max(1, min(PREPROCESS_CHUNK_SIZE, int(self.memory_budget // BYTES_PER_PREPROCESSED_FACE)))
+
+    @staticmethod
+    def area_vectors(vertices):
+        """Calculating the area vectors of the faces in double precision.
+        Args:
+            vertices (np.array): with format face_count x 3 x 3.
+        Returns:
+            the cross products of the edges with format face_count x 3, their length is twice the face area.
+        """
+        v0 = vertices[:, 0, :].astype(np.float64)
+        v1 = vertices[:, 1, :].astype(np.float64)
+        v2 = vertices[:, 2, :].astype(np.float64)
+        return np.cross(np.subtract(v1, v0), np.subtract(v2, v0))
+
+    def compact_mesh(self, normals, vertices, points=None, faces=None):
+        """Normalising the area vectors and removing the faces without area.
+        Args:
+            normals (np.array): area vectors with format face_count x 3, in double precision.
+            vertices (np.array): with format face_count x 3 x 3, or None for indexed meshes.
+            points (np.array): the unique points of indexed meshes.
+            faces (np.array): the face_count x 3 indices of indexed meshes.
+        Returns:
+            mesh (CompactMesh): the faces with an area, stored in self.dtype.
+        """
+        # calc area size and filter faces without area
+        areas = np.sqrt(np.sum(np.square(normals), axis=-1))
+        has_area = areas != 0
+        normals = normals[has_area]
+        areas = areas[has_area]
+
+        # normalise area vector and correct area size
+        # the area vectors are always calculated in double precision, only the results are stored in self.dtype
+        normals = (normals / areas.reshape(len(areas), 1)).astype(self.dtype, copy=False)
+        areas = (areas / 2).astype(self.dtype, copy=False)  # halve, because areas are triangles and not parallelograms
+        if faces is not None:
+            return CompactMesh(normals, None, areas, points=points, faces=faces[has_area])
+        return CompactMesh(normals, vertices[has_area].astype(self.dtype, copy=False), areas)
+
+    def negligible_face_size(self):
+        """Returns the area size below which faces are neglected, it is smaller in the extended mode."""
+        return 0.1 * self.NEGL_FACE_SIZE if self.extended_mode else self.NEGL_FACE_SIZE
+
     def favour_side(self, favside):
-        """This function weights the size of orientations closer than 45 deg
+        """This function weights the size of orientations closer than about 18 deg, see ANGLE_SCALE,
         to a favoured side higher.
         Args:
             favside (string): the favoured side  "[[0,-1,2.5],3]"
@@ -277,13 +960,12 @@ class Tweak:
         print("You favour the side {} with a factor of {}".format(side, f))
 
         # Filter the aligning orientations
-        diff = np.subtract(self.mesh[:, 0, :], side)
-        align = np.sum(diff * diff, axis=1) < self.ANGLE_SCALE  # 0.7654, ANGLE_SCALE ist around 0.1
-        mesh_not_align = self.mesh[np.logical_not(align)]
-        mesh_align = self.mesh[align]
-        mesh_align[:, 5, 0] = f * mesh_align[:, 5, 0]  # weight aligning orientations
-
-        self.mesh = np.concatenate((mesh_not_align, mesh_align), axis=0)
+        diff = np.subtract(self.mesh.normals, side)
+        align = np.sum(diff * diff, axis=1) < self.ANGLE_SCALE
+        order = np.concatenate((np.flatnonzero(np.logical_not(align)), np.flatnonzero(align)))
+        self.mesh = self.mesh.take(order)
+        aligned = len(order) - np.count_nonzero(align)
+        self.mesh.areas[aligned:] = f * self.mesh.areas[aligned:]  # weight aligning orientations
 
     def area_cumulation(self, best_n):
         """
@@ -294,70 +976,165 @@ class Tweak:
         Returns:
             list of the common orientation-tuples.
         """
-        alignments = self.mesh[:, 0, :]
-        orient = Counter()
-        for index in range(len(self.mesh)):  # Accumulate area-vectors
-            orient[tuple(alignments[index])] += self.mesh[index, 5, 0]
-
-        top_n = orient.most_common(best_n)
+        alignments = self.mesh.normals
+        if len(alignments) == 0:
+            return list()
+
+        # Group equal area vectors by sorting them (adding 0.0 merges -0.0 into 0.0, as in tuple comparisons).
+        # The sort is stable, so the first face of each group is the first occurrence of this area vector.
+        keys = alignments + 0.0
+        order = np.lexsort((keys[:, 2], keys[:, 1], keys[:, 0]))
+        keys = keys[order]
+        group_start = np.ones(len(keys), dtype=bool)
+        group_start[1:] = np.any(keys[1:] != keys[:-1], axis=1)
+        del keys
+        group_ids = np.empty(len(order), dtype=np.intp)
+        group_ids[order] = np.cumsum(group_start) - 1
+        first_face = order[group_start]
+        del order, group_start
+
+        # Accumulate area-vectors, bincount sums up in face order
+        areas = np.bincount(group_ids, weights=self.mesh.areas)
+
+        # Most common first, ties are broken by the first occurrence
+        best = np.lexsort((first_face, -areas))[:best_n]
+        top_n = [(tuple(alignments[first_face[group]]), areas[group]) for group in best]
         sleep(0)  # Yield, so other threads get a bit of breathing space.
         return top_n
 
-    def death_star(self, best_n):
+    def death_star(self, best_n, samples=DEATH_STAR_SAMPLES, seed=None):
         """
         Creating random faces by adding a random vertex to an existing edge.
         Common orientations of these faces are promising orientations for
-        placement.
+        placement. The faces are drawn in chunks and only the counts of their orientations are accumulated, so
+        the memory does not grow with the size of the mesh.
         Args:
             best_n (int): amount of orientations to return.
+            samples (int): amount of random faces, independent of the size of the mesh.
+            seed (int): seed of the random generator, None draws a fresh seed.
         Returns:
             list of the common orientation-tuples.
         """
-
-        # Small files need more calculations
+        random = np.random.RandomState(seed)
         mesh_len = len(self.mesh)
-        iterations = int(np.ceil(20000 / (mesh_len + 100)))
-
-        vertexes = self.mesh[:mesh_len, 1:4, :]
-        tot_normalized_orientations = np.zeros((iterations * mesh_len + 1, 3))
-        for i in range(iterations):
-            two_vertexes = vertexes[:, np.random.choice(3, 2, replace=False)]
-            vertex_0 = two_vertexes[:, 0, :]
-            vertex_1 = two_vertexes[:, 1, :]
-
-            # Using a linear congruency generator instead to choice pseudo
-            # random vertexes. Adding i to get more iterations.
-            vertex_2 = vertexes[(np.arange(mesh_len) * 127 + 8191 + i) % mesh_len, i % 3, :]
+        # the orientations are rounded to 6 decimals and each component is stored in 21 bits of a single integer
+        scale = 10 ** 6
+        base = 2 * scale + 1
+
+        counts = Counter()
+        for start in range(0, samples, DEATH_STAR_CHUNK_SIZE):
+            size = min(DEATH_STAR_CHUNK_SIZE, samples - start)
+            # an edge of a random face and a random vertex of another random face
+            faces = random.randint(mesh_len, size=size)
+            edges = np.argsort(random.random_sample((size, 3)), axis=1)[:, :2]
+            vertexes = self.mesh.face_vertices(faces)
+            vertex_0 = vertexes[np.arange(size), edges[:, 0]].astype(np.float64)
+            vertex_1 = vertexes[np.arange(size), edges[:, 1]].astype(np.float64)
+            vertex_2 = self.mesh.face_vertices(random.randint(mesh_len, size=size))[
+                np.arange(size), random.randint(3, size=size)].astype(np.float64)
             normals = np.cross(np.subtract(vertex_2, vertex_0),
                                np.subtract(vertex_1, vertex_0))
 
-            # normalise area vector
-            lengths = np.sqrt((normals * normals).sum(axis=1)).reshape(mesh_len, 1)
-            # ignore ZeroDivisions
-            with np.errstate(divide='ignore', invalid='ignore'):
-                normalized_orientations = np.around(np.true_divide(normals, lengths),
-                                                    decimals=6)
-
-            tot_normalized_orientations[mesh_len * i:mesh_len * (i + 1)] = normalized_orientations
+            # normalise area vector and ignore degenerated faces
+            lengths = np.sqrt((normals * normals).sum(axis=1))
+            valid = lengths > 0
+            quantized = np.rint(normals[valid] / lengths[valid, None] * scale).astype(np.int64) + scale
+            keys, key_counts = np.unique((quantized[:, 0] * base + quantized[:, 1]) * base + quantized[:, 2],
+                                         return_counts=True)
+            counts.update(dict(zip(keys.tolist(), key_counts.tolist())))
+            self.check_cancelled()
+            self.update_progress(PROGRESS_AREA_CUMULATION + (PROGRESS_DEATH_STAR - PROGRESS_AREA_CUMULATION) *
+                                 (start + size) / samples)
             sleep(0)  # Yield, so other threads get a bit of breathing space.
 
-        # search the most common orientations
-        orientations = np.inner(np.array([1, 1e3, 1e6]), tot_normalized_orientations)
-        orient = Counter(orientations)
-        top_n = orient.most_common(best_n)
+        # search the most common orientations, ties are broken by the key to be independent of the chunks
+        top_n = sorted(counts.items(), key=lambda x: (-x[1], x[0]))[:best_n]
         top_n = list(filter(lambda x: x[1] > 2, top_n))
 
         candidate = list()
-        for sum_side, count in top_n:
-            face_unique, face_count = np.unique(tot_normalized_orientations[orientations == sum_side], axis=0,
-                                                return_counts=True)
-            candidate += [[list(face_unique[i]), count] for i, count in enumerate(face_count)]
-        # Filter non-injective singles
-        candidate = list(filter(lambda x: x[1] >= 2, candidate))
+        for key, count in top_n:
+            components = [key // base ** 2, key // base % base, key % base]
+            candidate.append([[(c - scale) / scale for c in components], count])
         # also add anti-parallel orientations
         candidate += [[list((-v[0][0], -v[0][1], -v[0][2])), v[1]] for v in candidate]
         return candidate
 
+    def convex_hull(self, best_n):
+        """
+        Gathering the stable resting orientations, as a part can only rest on a face of its convex hull.
+        The facets of the hull are grouped by their normal and accumulated by their area, like in the area
+        cumulation, so the result is deterministic and only contains physically meaningful orientations.
+        Args:
+            best_n (int): amount of orientations to return.
+        Returns:
+            list of the orientation-tuples of the largest hull faces, or None if scipy is not installed or the
+            mesh has no volume.
+        """
+        if ConvexHull is None:
+            return None
+        try:
+            hull = ConvexHull(self.mesh.welded_points()[0].astype(np.float64))
+        except (RuntimeError, ValueError):  # e.g. a flat mesh, qhull errors derive from RuntimeError
+            return None
+
+        corners = hull.points[hull.simplices]
+        areas = np.sqrt(np.sum(np.square(np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])),
+                               axis=-1)) / 2
+        normals = hull.equations[:, :3]  # outward unit normals, the part rests on the facet if it points down
+        # the hull is triangulated, coplanar facets share their normal up to rounding to 6 decimals
+        quantized = np.rint(normals * 10 ** 6).astype(np.int64)
+        _, first_facet, groups = np.unique(quantized, axis=0, return_index=True, return_inverse=True)
+        group_areas = np.bincount(groups.reshape(-1), weights=areas)
+
+        # largest first, ties are broken by the first facet
+        best = np.lexsort((first_facet, -group_areas))[:best_n]
+        sleep(0)  # Yield, so other threads get a bit of breathing space.
+        return [[tuple(normals[first_facet[group]]), group_areas[group]] for group in best]
+
+    def sphere_sweep(self, best_n, min_volume):
+        """
+        Estimating the overhang of every direction of a dense geodesic grid, so that promising orientations between
+        the gathered ones are found. The normals are accumulated in a histogram once, see
+        CompactMesh.normal_histogram, hence each direction only costs a pass over its bins. The normals that point
+        straight down are assumed to rest on the build plate, the contour is estimated as in the fast mode and the
+        height of the overhangs is not known.
+        Args:
+            best_n (int): amount of orientations to return, they are at least SWEEP_SEPARATION degrees apart.
+            min_volume (bool): minimize the support material volume or supported surfaces
+        Returns:
+            list of the orientation-tuples with the lowest estimated unprintability, with the estimate.
+        """
+        areas, normals = self.mesh.normal_histogram(SWEEP_HISTOGRAM_SUBDIVISIONS, self.preprocess_chunk_size())
+        occupied = areas > 0
+        areas, normals = areas[occupied], normals[occupied]
+        directions = geodesic_sphere(SWEEP_SUBDIVISIONS)
+
+        estimates = np.empty(len(directions))
+        for start in range(0, len(directions), SWEEP_CHUNK_SIZE):
+            # the directions point upwards, with format chunk_size x bin_count
+            alignments = project_onto(normals, directions[start:start + SWEEP_CHUNK_SIZE])
+            resting = alignments < -np.cos(np.radians(SWEEP_BOTTOM_ANGLE))
+            inner = np.maximum(self.ASCENT - alignments, 0)
+            inner[resting] = 0
+            if min_volume:
+                overhang = np.sum(areas * inner ** self.OV_H, axis=1)
+            else:
+                overhang = 2 * np.sum(areas * inner ** 2, axis=1)
+            bottom = np.sum(areas * resting, axis=1)
+            estimates[start:start + len(bottom)] = self.target_function(bottom, overhang, 4 * np.sqrt(bottom),
+                                                                        min_volume)
+
+        # the best direction of each region, ties are broken by the order of the grid
+        picked = list()
+        separation = np.cos(np.radians(SWEEP_SEPARATION))
+        for index in np.argsort(estimates, kind="mergesort"):
+            if len(picked) == best_n:
+                break
+            if not picked or np.amax(project_onto(directions[picked], directions[index])) < separation:
+                picked.append(index)
+        sleep(0)  # Yield, so other threads get a bit of breathing space.
+        return [[tuple(-directions[index]), estimates[index]] for index in picked]
+
     @staticmethod
     def add_supplements():
         """Supplement 18 additional vectors.
@@ -375,39 +1152,270 @@ class Tweak:
     @staticmethod
     def remove_duplicates(old_orients):
         """Removing duplicate and similar orientations.
+        The kept vectors are hashed into a grid with cells as large as the tolerance of np.allclose, so each
+        vector is only compared with the kept vectors in the 27 neighbouring cells instead of all of them.
         Args:
             old_orients (list): list of faces
         Returns:
-            Unique orientations"""
+            Unique orientations, of similar orientations the first one is kept"""
         alpha = 5  # in degrees
-        tol_angle = np.sin(alpha * np.pi / 180)
+        tol_angle = float(np.sin(alpha * np.pi / 180))
+        rtol = 1e-05  # the default relative tolerance of np.allclose
+        if len(old_orients) == 0:
+            return list()
+        vectors = np.array([i[0] for i in old_orients], dtype=np.float64).reshape(len(old_orients), 3)
+        finite = np.isfinite(vectors).all(axis=1)
+        # redundant vectors have an angle smaller than alpha = arcsin(atol). atol=0.087 -> alpha = 5 degrees.
+        # No component tolerance exceeds the cell size, hence similar vectors lie in adjacent cells.
+        cell_size = tol_angle + rtol * (np.abs(vectors[finite]).max() if finite.any() else 0.)
+        cells = np.floor(np.where(finite[:, None], vectors, 0.) / cell_size).astype(np.int64)
+        neighbours = [(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)]
+
+        grid = dict()
+        irregular = list()  # kept vectors with infinite components, they can't be hashed
         orientations = list()
-        for i in old_orients:
-            duplicate = None
-            for j in orientations:
-                # redundant vectors have an angle smaller than
-                # alpha = arcsin(atol). atol=0.087 -> alpha = 5 degrees
-                if np.allclose(i[0], j[0], atol=tol_angle):
-                    duplicate = True
-                    break
-            if duplicate is None:
+        for i, vector, (x, y, z), is_finite in zip(old_orients, vectors.tolist(), cells.tolist(), finite.tolist()):
+            if is_finite:
+                duplicate = any(all(abs(a - b) <= tol_angle + rtol * abs(b) for a, b in zip(vector, kept))
+                                for dx, dy, dz in neighbours for kept in grid.get((x + dx, y + dy, z + dz), ()))
+                if not duplicate:
+                    grid.setdefault((x, y, z), list()).append(vector)
+            elif not any(math.isnan(a) for a in vector):  # nan is never close to anything and always kept
+                duplicate = any(np.allclose(vector, kept, atol=tol_angle) for kept in irregular)
+                if not duplicate:
+                    irregular.append(vector)
+            else:
+                duplicate = False
+            if not duplicate:
                 orientations.append(i)
         return orientations
 
+    def coarse_to_fine(self, orientations, min_volume, face_count, top_k, progress=None):
+        """Scoring all orientations on a level-of-detail sample of the mesh first, and only the top_k of them
+        on the full mesh. The statistics are stored in self.lod, its fine_skipped are the top_k orientations that
+        weren't re-scored on the full mesh as the deadline passed.
+        Args:
+            orientations (list): list of orientation-tuples as returned by the gathering algorithms.
+            min_volume (bool): minimize the support material volume or supported surfaces
+            face_count (int): amount of faces of the sampled mesh.
+            top_k (int): amount of orientations that are re-scored on the full mesh.
+            progress (tuple): optional range of the progress in percent, split in proportion to the faces.
+        Returns:
+            list of [orientation, bottom, overhang, contour, unprintability] of the top_k orientations.
+        """
+        t_start = time()
+        lod_mesh = self.mesh.sample(face_count)
+        coarse_progress = fine_progress = None
+        if progress is not None:
+            coarse_work = len(orientations) * len(lod_mesh)
+            split = progress[0] + (progress[1] - progress[0]) * coarse_work / (coarse_work + top_k * len(self.mesh))
+            coarse_progress, fine_progress = (progress[0], split), (split, progress[1])
+        coarse_results = self.lithography(orientations, min_volume, mesh=lod_mesh, progress=coarse_progress)
+        ranking = sorted(range(len(coarse_results)), key=lambda i: coarse_results[i][4])
+        t_coarse = time()
+        top = [orientations[i] for i in ranking[:top_k]]
+        results = self.lithography(top, min_volume, progress=fine_progress)
+        t_fine = time()
+
+        # compare with the time a full evaluation of the remaining orientations would have taken
+        time_saved = (t_fine - t_coarse) / max(1, len(results)) * (len(coarse_results) - len(results)) - \
+            (t_coarse - t_start)
+        self.lod = {"faces": len(lod_mesh), "candidates": len(orientations), "evaluated": len(coarse_results),
+                    "top_k": top_k, "fine_skipped": len(top) - len(results), "ranking": ranking,
+                    "time_saved": time_saved}
+        return results
+
+    def lithography(self, orientations, min_volume, mesh=None, progress=None, branch_and_bound=False):
+        """Calculating the unprintability of all orientations. The vertices are projected onto a block of
+        orientations at once, the block size is chosen such that the face_count x block intermediates stay
+        within the memory budget. The results equal those of project_vertices and calc_overhang.
+        If the deadline passes, the remaining orientations are skipped, but the first block is always evaluated.
+        Args:
+            orientations (list): list of orientation-tuples as returned by the gathering algorithms.
+            min_volume (bool): minimize the support material volume or supported surfaces
+            mesh (CompactMesh): the mesh to evaluate, self.mesh by default.
+            progress (tuple): optional range of the progress in percent, reported after each block.
+            branch_and_bound (bool): evaluate the orientations in order of their lower bound, see
+                unprintability_bounds, and skip those whose bound exceeds the best unprintability found so far.
+                The best orientation is the same, the pruned ones are counted in stats.candidates_pruned.
+        Returns:
+            list of [orientation, bottom, overhang, contour, unprintability] in the order of the orientations.
+        """
+        full_mesh = mesh is None
+        mesh = self.mesh if mesh is None else mesh
+        orientations = -1 * np.array([side[0] for side in orientations], dtype=np.float64).reshape(-1, 3)
+        # the per-face constants are computed once and count against the budget, unless they are cached already
+        constants = (min_volume, self.extended_mode and not self.exact_contour)
+        constant_bytes = mesh.face_constant_bytes(*constants)
+        block_size = max(1, int((self.memory_budget - constant_bytes * len(mesh)) //
+                                (BYTES_PER_PROJECTION * max(1, len(mesh)))))
+        chunk_size = None
+        if (BYTES_PER_PROJECTION + constant_bytes) * len(mesh) > self.memory_budget:
+            # out-of-core: a single orientation exceeds the budget, hence the faces are evaluated in chunks, each
+            # chunk computes its own constants and indexed meshes gather its vertices, see CompactMesh.chunks
+            block_size = CHUNKED_BLOCK_SIZE
+            chunk_bytes = BYTES_PER_PROJECTION * block_size + mesh.face_constant_bytes(*constants) + \
+                (9 * np.dtype(mesh.dtype).itemsize if mesh.indexed else 0)
+            chunk_size = max(1, int(self.memory_budget // chunk_bytes))
+            self.stats.chunk_faces = chunk_size
+        elif self.kernels.face_constants:
+            mesh.cache_face_constants(*constants, chunk_size=self.preprocess_chunk_size())
+        if self.deadline is not None:
+            block_size = min(block_size, DEADLINE_BLOCK_SIZE)
+        if branch_and_bound:
+            block_size = min(block_size, BOUND_BLOCK_SIZE)
+
+        order = np.arange(len(orientations))
+        bounds = None
+        if branch_and_bound:
+            bounds = self.unprintability_bounds(orientations, min_volume, mesh)
+            order = np.argsort(bounds, kind="mergesort")
+
+        results = list()
+        evaluated = list()
+        best = np.inf
+        pruned = 0
+        rtol = np.sqrt(np.finfo(mesh.dtype).eps)  # the rounding of the bounds and of the kernels differs
+        for start in range(0, len(orientations), block_size):
+            if start > 0 and self.deadline_passed():
+                break
+            self.check_cancelled()
+            indices = order[start:start + block_size]
+            if bounds is not None:
+                # the bounds are ascending, once one exceeds the best unprintability all remaining ones do
+                keep = bounds[indices] <= best + rtol * abs(best)
+                if not keep.all():
+                    pruned = len(orientations) - start - np.count_nonzero(keep)
+                    if not keep[0]:
+                        break
+                    indices = indices[keep]
+            block = orientations[indices]
+            faces = len(mesh) if chunk_size is None else min(len(mesh), chunk_size)
+            self.stats.peak_block_bytes = max(self.stats.peak_block_bytes,
+                                              len(block) * faces * 3 * np.dtype(mesh.dtype).itemsize)
+            for orientation, (bottom, overhang, contour) in zip(block, self.calc_overhang_block(block, min_volume, mesh,
+                                                                                                chunk_size)):
+                unprintability = self.target_function(bottom, overhang, contour, min_volume=min_volume)
+                results.append([orientation, bottom, overhang, contour, unprintability])
+                best = min(best, unprintability)
+                if full_mesh and (self.best_result is None or unprintability < self.best_result[4]):
+                    self.best_result = results[-1]
+            evaluated += list(indices)
+            if progress is not None:
+                self.update_progress(progress[0] + (progress[1] - progress[0]) * len(results) / len(orientations))
+            sleep(0)  # Yield, so other threads get a bit of breathing space.
+            if pruned > 0:
+                break
+        if branch_and_bound:
+            self.stats.candidates_pruned = pruned
+        return [results[i] for i in np.argsort(evaluated, kind="mergesort")]
+
+    def unprintability_bounds(self, orientations, min_volume, mesh=None):
+        """Calculating a lower bound of the unprintability of each orientation from the centroids of the faces,
+        without projecting their vertices. The lowest centroid bounds the lowest vertex from above, hence all
+        faces whose centroid is within FIRST_LAY_H of it may be bottom faces and all overhanging faces above
+        them are certain overhangs. The overhang is bounded from below, the bottom area and contour from above.
+        Returns -inf for all orientations if the parameters don't make the target function increase with the
+        overhang and decrease with the bottom and contour, as these bounds then don't hold.
+        Args:
+            orientations (np.array): with format K x 3.
+            min_volume (bool): minimize the support material volume or supported surfaces
+            mesh (CompactMesh): the mesh to evaluate, self.mesh by default.
+        Returns:
+            the lower bounds with format K.
+        """
+        mesh = self.mesh if mesh is None else mesh
+        bounds = np.full(len(orientations), -np.inf)
+        if min(self.TAR_A, self.RELATIVE_F, self.CONTOUR_F, self.BOTTOM_F, self.PLAFOND_ADV) < 0 or \
+                self.TAR_D <= 0 or self.OV_H <= 0 or \
+                (min_volume and (self.TAR_E < 0 or self.TAR_D - self.TAR_E * self.TAR_C <= 0 or
+                                 min(self.height_offset, self.height_log, self.height_log_k) < 0)):
+            return bounds
+        centroids, radii, perimeters = mesh.face_extents(self.preprocess_chunk_size())
+        areas = mesh.areas.astype(np.float64)
+        rtol = np.sqrt(np.finfo(mesh.dtype).eps)
+        block_size = max(1, int(self.memory_budget // (BYTES_PER_PROJECTION * max(1, len(mesh)))))
+        for start in range(0, len(orientations), block_size):
+            block = orientations[start:start + block_size]
+            # the centroids and normals are projected onto the block with format face_count x K
+            heights = project_onto(block, centroids)
+            alignments = project_onto(block, mesh.normals)
+            # tolerance for the rounding of the centroids and of the projections by the kernels
+            threshold = self.FIRST_LAY_H + rtol * (np.amax(np.abs(heights), axis=0) + 1)
+            heights -= np.amin(heights, axis=0)
+            maybe_bottom = heights < threshold
+            bottom = np.dot(areas, maybe_bottom)
+
+            # only the faces above all possible bottom faces certainly overhang
+            inner = np.maximum(self.ASCENT - alignments, 0)
+            inner[heights <= threshold] = 0
+            if min_volume:
+                overhang = np.dot(areas, (self.height_offset + self.height_log *
+                                          np.log(self.height_log_k * heights + 1)) * inner ** self.OV_H)
+            else:
+                overhang = 2 * np.dot(areas, inner ** 2)
+            if self.extended_mode:  # the plafond of all faces facing straight down, whether they overhang or not
+                for k, orientation in enumerate(block):
+                    downwards = min(self.ASCENT, 1e-9 - np.dot(orientation, orientation))
+                    faces = np.flatnonzero(alignments[:, k] < downwards)
+                    faces = faces[(mesh.normals[faces] == -orientation).all(axis=1)]
+                    overhang[k] -= self.PLAFOND_ADV * np.sum(areas[faces])
+
+            if self.extended_mode and self.exact_contour:  # the boundary consists of edges of the bottom faces
+                contour = np.dot(perimeters, maybe_bottom) + self.CONTOUR_AMOUNT
+            elif self.extended_mode:  # the edge of a touching face between its lowest vertices
+                # the median vertex is at least half the radius below the centroid, as the highest one is within it
+                contour = np.dot(perimeters, heights - radii[:, None] / 2 < threshold) / 2 + self.CONTOUR_AMOUNT
+            else:
+                contour = 4 * np.sqrt(bottom)
+
+            if min_volume:
+                overhang /= 25
+            denominator = self.TAR_D + (self.TAR_E * overhang if min_volume else 0)
+            # a negative numerator is smallest with the smallest denominator, without bottom and contour
+            denominator = np.where(overhang + self.TAR_C >= 0,
+                                   denominator + self.CONTOUR_F * contour + self.BOTTOM_F * bottom, denominator)
+            valid = denominator > 0
+            bounds[start:start + block_size][valid] = (self.TAR_A * (overhang + self.TAR_B) + self.RELATIVE_F *
+                                                       (overhang + self.TAR_C) / denominator)[valid]
+        return bounds
+
+    def check_cancelled(self):
+        """Raises TweakCancelled if the cancellation token is cancelled, the mesh is freed right away."""
+        if self.cancel_token is not None and self.cancel_token.cancelled:
+            self.mesh = None
+            raise TweakCancelled()
+
+    def deadline_passed(self):
+        """Returns whether the time budget is used up."""
+        return self.deadline is not None and time() > self.deadline
+
+    def calc_overhang_block(self, orientations, min_volume, mesh=None, chunk_size=None):
+        """Calculating bottom and overhang area as well as the contour length for a block of orientations.
+        Args:
+            orientations (np.array): with format K x 3.
+            min_volume (bool): minimize the support material volume or supported surfaces
+            mesh (CompactMesh): the mesh to evaluate, self.mesh by default.
+            chunk_size (int): optional amount of faces that are evaluated at once.
+        Returns:
+            list of K tuples (bottom, overhang, contour), equal to those of calc_overhang.
+        """
+        return self.kernels.calc_overhang_block(self, self.mesh if mesh is None else mesh, orientations, min_volume,
+                                                chunk_size)
+
     def project_vertices(self, orientation):
-        """Supplement the mesh array with scalars (max and median)
+        """Supplement the mesh with scalars (max and median)
         for each face projected onto the orientation vector.
         Args:
             orientation (np.array): with format 3 x 3.
         Returns:
             adjusted mesh.
         """
-        self.mesh[:, 4, 0] = np.inner(self.mesh[:, 1, :], orientation)
-        self.mesh[:, 4, 1] = np.inner(self.mesh[:, 2, :], orientation)
-        self.mesh[:, 4, 2] = np.inner(self.mesh[:, 3, :], orientation)
+        self.mesh.allocate_scratch()
+        self.mesh.projected[:] = self.mesh.project(orientation)
 
-        self.mesh[:, 5, 1] = np.max(self.mesh[:, 4, :], axis=1)
-        self.mesh[:, 5, 2] = np.median(self.mesh[:, 4, :], axis=1)
+        self.mesh.proj_max[:] = np.max(self.mesh.projected, axis=1)
+        self.mesh.proj_median[:] = np.median(self.mesh.projected, axis=1)
         sleep(0)  # Yield, so other threads get a bit of breathing space.
 
     def calc_overhang(self, orientation, min_volume):
@@ -419,62 +1427,79 @@ class Tweak:
         Returns:
             the total bottom size, overhang size and contour length of the mesh
         """
-        total_min = np.amin(self.mesh[:, 4, :])
+        mesh = self.mesh
+        total_min = np.amin(mesh.projected)
+        # the features are summed over all faces, with zeros for the filtered ones, in the order of the block kernels
+        face_sums = np.zeros(len(mesh), dtype=mesh.areas.dtype)
 
         # filter bottom area
-        bottom = np.sum(self.mesh[np.where(self.mesh[:, 5, 1] < total_min + self.FIRST_LAY_H), 5, 0])
-        # # equal than:
-        # bottoms = mesh[np.where(mesh[:, 5, 1] < total_min + FIRST_LAY_H)]
-        # if len(bottoms) > 0: bottom = np.sum(bottoms[:, 5, 0])
-        # else: bottom = 0
+        bottom_faces = np.where(mesh.proj_max < total_min + self.FIRST_LAY_H)
+        face_sums[bottom_faces] = mesh.areas[bottom_faces]
+        bottom = np.sum(face_sums, dtype=np.float64)
 
         # filter overhangs
-        overhangs = self.mesh[np.where(np.inner(self.mesh[:, 0, :], orientation) < self.ASCENT)]
-        overhangs = overhangs[np.where(overhangs[:, 5, 1] > (total_min + self.FIRST_LAY_H))]
+        overhangs = np.where(project_onto(mesh.normals, orientation) < self.ASCENT)[0]
+        overhangs = overhangs[np.where(mesh.proj_max[overhangs] > (total_min + self.FIRST_LAY_H))]
+        overhang_normals = mesh.normals[overhangs]
+        overhang_areas = mesh.areas[overhangs]
 
         if self.extended_mode:
-            plafond = np.sum(overhangs[(overhangs[:, 0, :] == -orientation).all(axis=1), 5, 0])
+            plafonds = overhangs[(overhang_normals == -orientation).all(axis=1)]
+            face_sums[:] = 0
+            face_sums[plafonds] = mesh.areas[plafonds]
+            plafond = np.sum(face_sums, dtype=np.float64)
         else:
             plafond = 0
 
         if len(overhangs) > 0:
             if min_volume:
-                heights = np.inner(overhangs[:, 1:4, :].mean(axis=1), orientation) - total_min
-
-                inner = np.inner(overhangs[:, 0, :], orientation) - self.ASCENT
-                # overhang = np.sum(heights * overhangs[:, 5, 0] * np.abs(inner * (inner < 0)) ** 2)
-                overhang = np.sum((self.height_offset + self.height_log * np.log(self.height_log_k * heights + 1)) *
-                                  overhangs[:, 5, 0] * np.abs(inner * (inner < 0)) ** self.OV_H)
+                heights = project_onto(mesh.face_vertices(overhangs).mean(axis=1), orientation) - total_min
+
+                inner = project_onto(overhang_normals, orientation) - self.ASCENT
+                # overhang = np.sum(heights * overhang_areas * np.abs(inner * (inner < 0)) ** 2)
+                face_sums[:] = 0
+                face_sums[overhangs] = (self.height_offset + self.height_log *
+                                        np.log(self.height_log_k * heights + 1)) * \
+                    overhang_areas * np.abs(inner * (inner < 0)) ** self.OV_H
+                overhang = np.sum(face_sums, dtype=np.float64)
             else:
-                # overhang = np.sum(overhangs[:, 5, 0] * 2 *
+                # overhang = np.sum(overhang_areas * 2 *
                 #                   (np.amax((np.zeros(len(overhangs)) + 0.5,
-                #                             - np.inner(overhangs[:, 0, :], orientation)),
+                #                             - np.inner(overhang_normals, orientation)),
                 #                            axis=0) - 0.5) ** 2)
                 # improved performance by finding maximum using the multiplication method, see:
                 # https://stackoverflow.com/questions/32109319/how-to-implement-the-relu-function-in-numpy
-                inner = np.inner(overhangs[:, 0, :], orientation) - self.ASCENT
-                overhang = 2 * np.sum(overhangs[:, 5, 0] * np.abs(inner * (inner < 0)) ** 2)
+                inner = project_onto(overhang_normals, orientation) - self.ASCENT
+                face_sums[:] = 0
+                face_sums[overhangs] = overhang_areas * np.abs(inner * (inner < 0)) ** 2
+                overhang = 2 * np.sum(face_sums, dtype=np.float64)
             overhang -= self.PLAFOND_ADV * plafond
 
         else:
             overhang = 0
 
         # filter the total length of the bottom area's contour
-        if self.extended_mode:
-            # contours = self.mesh[total_min+self.FIRST_LAY_H < self.mesh[:, 5, 1]]
-            contours = self.mesh[np.where(self.mesh[:, 5, 2] < total_min + self.FIRST_LAY_H)]
+        if self.extended_mode and self.exact_contour:
+            bottom_faces = mesh.proj_max < total_min + self.FIRST_LAY_H
+            contour = mesh.boundary_length(bottom_faces)
+            if np.any(bottom_faces):
+                contour += self.CONTOUR_AMOUNT
+        elif self.extended_mode:
+            contours = np.where(mesh.proj_median < total_min + self.FIRST_LAY_H)[0]
 
             if len(contours) > 0:
                 conlen = np.arange(len(contours))
-                sortsc0 = np.argsort(contours[:, 4, :], axis=1)[:, 0]
-                sortsc1 = np.argsort(contours[:, 4, :], axis=1)[:, 1]
+                sortsc0 = np.argsort(mesh.projected[contours], axis=1)[:, 0]
+                sortsc1 = np.argsort(mesh.projected[contours], axis=1)[:, 1]
 
+                vertices = mesh.face_vertices(contours)
                 con = np.array([np.subtract(
-                    contours[conlen, 1 + sortsc0, :],
-                    contours[conlen, 1 + sortsc1, :])])
+                    vertices[conlen, sortsc0, :],
+                    vertices[conlen, sortsc1, :])])
 
-                contours = np.sum(np.power(con, 2), axis=-1) ** 0.5
-                contour = np.sum(contours) + self.CONTOUR_AMOUNT * len(contours)
+                face_sums[:] = 0
+                face_sums[contours] = np.sum(np.power(con, 2), axis=-1) ** 0.5
+                contour = np.sum(face_sums, dtype=np.float64) + self.CONTOUR_AMOUNT
             else:
                 contour = 0
         else:  # consider the bottom area as square, bottom=a**2 ^ contour=4*a
@@ -498,27 +1523,80 @@ class Tweak:
         Returns:
             rotation axis, rotation angle, rotational matrix.
         """
-        if np.allclose(bestside[0], np.array([0, 0, -1]), atol=abs(self.VECTOR_TOL)):
-            rotation_axis = [1, 0, 0]
-            phi = np.pi
-        elif np.allclose(bestside[0], np.array([0, 0, 1]), atol=abs(self.VECTOR_TOL)):
-            rotation_axis = [1, 0, 0]
-            phi = 0
-        else:
-            phi = np.pi - np.arccos(-bestside[0][2])
-            rotation_axis = [-bestside[0][1], bestside[0][0], 0]  # the z-axis is fixed to 0 for this rotation
-            rotation_axis = [i / np.linalg.norm(rotation_axis) for i in rotation_axis]  # normalization
-
-        v = rotation_axis
-        rotational_matrix = np.array([[v[0] * v[0] * (1 - math.cos(phi)) + math.cos(phi),
-                                       v[0] * v[1] * (1 - math.cos(phi)) - v[2] * math.sin(phi),
-                                       v[0] * v[2] * (1 - math.cos(phi)) + v[1] * math.sin(phi)],
-                                      [v[1] * v[0] * (1 - math.cos(phi)) + v[2] * math.sin(phi),
-                                       v[1] * v[1] * (1 - math.cos(phi)) + math.cos(phi),
-                                       v[1] * v[2] * (1 - math.cos(phi)) - v[0] * math.sin(phi)],
-                                      [v[2] * v[0] * (1 - math.cos(phi)) - v[1] * math.sin(phi),
-                                       v[2] * v[1] * (1 - math.cos(phi)) + v[0] * math.sin(phi),
-                                       v[2] * v[2] * (1 - math.cos(phi)) + math.cos(phi)]], dtype=np.float64)
-        # rotational_matrix = np.around(rotational_matrix, decimals=6)
         sleep(0)  # Yield, so other threads get a bit of breathing space.
-        return rotation_axis, phi, rotational_matrix
+        return calc_euler(bestside[0], abs(self.VECTOR_TOL))
+
+
+class PreparedMesh:
+    """ A mesh that is prepared to be scored under several parameter sets.
+
+    The preprocessed mesh is kept for each NEGL_FACE_SIZE, and the features (bottom, overhang, contour) of the
+    candidate orientations are kept for each combination of the parameters that influence them. Parameter sets
+    that only differ in the TARGET_PARAMETERS of the target function are re-scored without any geometry work, a
+    whole population of them in one vectorized call. Other changes, like min_volume, the favoured side or the
+    ASCENT, reuse the preprocessed mesh and only repeat the candidate search and the lithography.
+    """
+
+    def __init__(self, content, indices=None, extended_mode=False, **kwargs):
+        self.content = content
+        self.indices = indices
+        self.extended_mode = extended_mode
+        self.kwargs = kwargs  # further keyword arguments for Tweak, e.g. single_precision
+        self._meshes = dict()
+        self._features = dict()
+
+    @staticmethod
+    def feature_key(parameter, min_volume, favside=None):
+        """Returns the key of the parameters that influence the features, the rotation tolerance doesn't."""
+        return min_volume, favside, tuple(sorted((name, value) for name, value in parameter.items()
+                                                 if name not in TARGET_PARAMETERS and name != "VECTOR_TOL"))
+
+    def features(self, parameter=None, min_volume=False, favside=None):
+        """Returns the candidate orientations and their features, they are only calculated on the first call
+        for the parameters that influence them.
+        Args:
+            parameter (dict): the parameter set, PARAMETER or PARAMETER_VOL by default.
+            min_volume (bool): minimize the support material volume or supported surfaces
+            favside (string): the favoured side, if any.
+        Returns:
+            the orientations and their (bottom, overhang, contour) features, both with format N x 3.
+        """
+        if parameter is None:
+            parameter = PARAMETER_VOL if min_volume else PARAMETER
+        key = self.feature_key(parameter, min_volume, favside)
+        if key not in self._features:
+            mesh = self._meshes.get(parameter["NEGL_FACE_SIZE"])
+            tweak = Tweak(self.content if mesh is None else mesh, indices=self.indices if mesh is None else None,
+                          extended_mode=self.extended_mode, verbose=False, favside=favside, min_volume=min_volume,
+                          parameter=parameter, keep_mesh=True, **self.kwargs)
+            self._meshes[parameter["NEGL_FACE_SIZE"]] = tweak.prepared_mesh
+            self._features[key] = (np.array([result[0] for result in tweak.best_5], dtype=np.float64),
+                                   np.array([result[1:4] for result in tweak.best_5], dtype=np.float64))
+        return self._features[key]
+
+    def score(self, parameter=None, min_volume=False, favside=None):
+        """Scoring the candidate orientations under a parameter set or a population of parameter sets.
+        Args:
+            parameter (dict or list): the parameter set, or a list of parameter sets that only differ in the
+                TARGET_PARAMETERS.
+            min_volume (bool): minimize the support material volume or supported surfaces
+            favside (string): the favoured side, if any.
+        Returns:
+            the orientations with format N x 3 and their unprintability with format N, or P x N for a population.
+        """
+        if parameter is None:
+            parameter = PARAMETER_VOL if min_volume else PARAMETER
+        if isinstance(parameter, dict):
+            orientations, features = self.features(parameter, min_volume, favside)
+        else:
+            keys = set(self.feature_key(pars, min_volume, favside) for pars in parameter)
+            if len(keys) > 1:
+                raise ValueError("The parameter sets of a population may only differ in the target parameters")
+            orientations, features = self.features(parameter[0], min_volume, favside)
+        return orientations, unprintability(features, parameter, min_volume)
+
+    def best(self, parameter=None, min_volume=False, favside=None):
+        """Returns the best orientation and its unprintability under the parameter set."""
+        orientations, scores = self.score(parameter, min_volume, favside)
+        best = int(np.argmin(scores))
+        return orientations[best], float(scores[best])
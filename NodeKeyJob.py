@@ -0,0 +1,20 @@
+from UM.Job import Job
+
+from .CalculateOrientationJob import CalculateOrientationJob
+
+
+class NodeKeyJob(Job):
+    """Computes the keys of nodes in the background, as hashing their mesh data would block the UI thread, see
+    CalculateOrientationJob.getNodeKey. The result is a dict of the keys by node."""
+
+    def __init__(self, nodes, min_volume = False, extended_mode = False):
+        super().__init__()
+        self._nodes = nodes
+        self._min_volume = min_volume
+        self._extended_mode = extended_mode
+
+    def run(self):
+        self.setResult({node: CalculateOrientationJob.getNodeKey(node, self._min_volume, self._extended_mode) for node in self._nodes})
+
+    def getNodes(self):
+        return self._nodes
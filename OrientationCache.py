@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Amount of results that are stored per mesh, equal to the best_5 results of the Tweaker
+CACHED_RESULTS = 5
+
+
+def mesh_fingerprint(vertices, scale=None, indices=None):
+    """Calculating a fingerprint of a mesh. The vertices are expected in the local frame of the mesh, so
+    the fingerprint does not change when the mesh is moved or rotated.
+    Args:
+        vertices (np.array): the untransformed vertices of the mesh.
+        scale (tuple): optional scale of the mesh, as scaling changes the resulting orientation.
+        indices (np.array): the faces of indexed meshes, which can differ for the same vertices.
+    Returns:
+        the fingerprint as hex string.
+    """
+    vertices = np.ascontiguousarray(vertices)
+    digest = hashlib.sha1(vertices.dtype.str.encode())
+    digest.update(str(vertices.shape).encode())
+    digest.update(vertices.data)
+    if indices is not None:
+        indices = np.ascontiguousarray(indices)
+        digest.update(b"indices" + indices.dtype.str.encode())
+        digest.update(str(indices.shape).encode())
+        digest.update(indices.data)
+    if scale is not None:
+        digest.update(str([round(float(x), 6) for x in scale]).encode())
+    return digest.hexdigest()
+
+
+def to_ranking(best_results):
+    """Converts the results of the Tweaker into a serializable ranking.
+    Args:
+        best_results (list): the best_5 list of a Tweak result.
+    Returns:
+        list of [alignment, bottom, overhang, contour, unprintability] of the best results.
+    """
+    ranking = list()
+    for alignment, bottom, overhang, contour, unprintability in (result[:5] for result in best_results[:CACHED_RESULTS]):
+        ranking.append([[float(x) for x in alignment], float(bottom), float(overhang), float(contour),
+                        float(unprintability)])
+    return ranking
+
+
+class OrientationCache:
+    """ Persistent least-recently-used cache of orientation results.
+
+    The cache maps a key, which is built from the mesh fingerprint and the parameters of the Tweaker, to the
+    ranking of the best alignments. It is stored as a JSON file and limited to max_entries entries.
+    All methods are thread-safe.
+    """
+
+    def __init__(self, path, max_entries=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def make_key(fingerprint, min_volume, extended_mode, favside=None):
+        """Combines the mesh fingerprint with the parameters that influence the result.
+        Args:
+            fingerprint (string): fingerprint of the mesh, see mesh_fingerprint.
+            min_volume (bool): whether PARAMETER_VOL or PARAMETER is used.
+            extended_mode (bool): whether the extended mode is used.
+            favside (string): the favoured side, if any.
+        Returns:
+            the cache key as string.
+        """
+        return "{fp}|{param}|{mode}|{fav}".format(fp=fingerprint, param="PARAMETER_VOL" if min_volume else "PARAMETER",
+                                                 mode="extended" if extended_mode else "fast", fav=favside or "")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the cached ranking for the key, or None if it is unknown."""
+        with self._lock:
+            ranking = self._entries.get(key)
+            if ranking is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return ranking
+
+    def put(self, key, ranking):
+        """Stores the ranking for the key, evicts the least recently used entries and saves the cache."""
+        with self._lock:
+            self._entries[key] = ranking
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self._save()
+
+    def statistics(self):
+        """Returns the amount of entries, hits and misses of the cache."""
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as cache_file:
+                entries = json.load(cache_file)
+        except (OSError, ValueError):  # no cache yet or a corrupt file, which gets overwritten
+            return
+        # the file stores the entries from the least to the most recently used
+        for key, ranking in entries:
+            self._entries[key] = ranking
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _save(self):
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w") as cache_file:
+                json.dump(list(self._entries.items()), cache_file)
+            os.replace(temp_path, self.path)
+        except OSError:
+            pass  # the cache is an optimisation, failing to persist it must not break the orientation
@@ -1,28 +1,40 @@
-from typing import List, cast
+from typing import Dict, List, Optional, cast
 
 from UM.Extension import Extension
+from UM.Logger import Logger
 from UM.PluginRegistry import PluginRegistry
 from UM.Scene.SceneNode import SceneNode
 from UM.Scene.Selection import Selection
 
 from UM.Message import Message
+from UM.Resources import Resources
 from cura.CuraApplication import CuraApplication
 
 from .CalculateOrientationJob import CalculateOrientationJob
+from .OrientationCache import OrientationCache
+from .OrientationScheduler import OrientationScheduler
+from .WarmUpJob import WarmUpJob
+from . import TweakEngine
 
 from UM.i18n import i18nCatalog
 
 import os
+from time import time
 i18n_catalog = i18nCatalog("OrientationPlugin")
 
 
 class OrientationPlugin(Extension):
     def __init__(self):
         super().__init__()
+        start_time = time()
         self.addMenuItem(i18n_catalog.i18n("Calculate fast optimal printing orientation"), self.doFastAutoOrientation)
         self.addMenuItem(i18n_catalog.i18n("Calculate extended optimal printing orientation"), self.doExtendedAutoOrientiation)
+        self.addMenuItem(i18n_catalog.i18n("Calculate progressive optimal printing orientation"), self.doProgressiveAutoOrientation)
         self.addMenuItem(i18n_catalog.i18n("Modify Settings"), self.showPopup)
         self._message = None
+        # The running jobs by their progress message, whose Cancel action cancels them. Signals only hold weak
+        # references to their functions, so the action is connected to a bound method instead of a lambda.
+        self._cancellable_jobs = {}  # type: Dict[Message, CalculateOrientationJob]
 
         self._currently_loading_files = []  # type: List[str]
         self._check_node_queue = []  # type: List[SceneNode]
@@ -30,6 +42,27 @@ class OrientationPlugin(Extension):
         self._do_auto_orientation = CuraApplication.getInstance().getPreferences().getValue("OrientationPlugin/do_auto_orientation")
         # Should the volume beneath the overhangs be penalized?
         CuraApplication.getInstance().getPreferences().addPreference("OrientationPlugin/min_volume", True)
+        # Should the orientation be calculated in parallel worker processes instead of the job thread? It has no
+        # checkbox yet, as the workers are only verified headless, and packaged Cura builds don't support them.
+        CuraApplication.getInstance().getPreferences().addPreference("OrientationPlugin/use_worker_processes", False)
+        # After how many seconds the auto-orientation of a loaded model uses the best orientation found so far.
+        CuraApplication.getInstance().getPreferences().addPreference("OrientationPlugin/auto_orientation_time_budget", 10.0)
+        # How many auto-orientation jobs may run at the same time, further loaded models wait for a free slot.
+        CuraApplication.getInstance().getPreferences().addPreference("OrientationPlugin/max_concurrent_jobs", 2)
+        # How many orientation results are kept in the persistent cache, 0 disables the cache.
+        CuraApplication.getInstance().getPreferences().addPreference("OrientationPlugin/cache_size", 1000)
+        self._cache = None  # type: Optional[OrientationCache]
+        cache_size = int(CuraApplication.getInstance().getPreferences().getValue("OrientationPlugin/cache_size"))
+        if cache_size > 0:
+            cache_path = os.path.join(Resources.getStoragePath(Resources.Preferences), "orientation_cache.json")
+            self._cache = OrientationCache(cache_path, max_entries = cache_size)
+        max_jobs = int(CuraApplication.getInstance().getPreferences().getValue("OrientationPlugin/max_concurrent_jobs"))
+        self._scheduler = OrientationScheduler(self._cache, max_jobs = max_jobs)
+        # Should the engine be imported and warmed up in the background once Cura is idle? Otherwise the first
+        # orientation imports it.
+        CuraApplication.getInstance().getPreferences().addPreference("OrientationPlugin/warm_up", True)
+        if CuraApplication.getInstance().getPreferences().getValue("OrientationPlugin/warm_up"):
+            CuraApplication.getInstance().callLater(self._warmUp)
 
         self._popup = None
 
@@ -37,8 +70,17 @@ class OrientationPlugin(Extension):
         CuraApplication.getInstance().fileCompleted.connect(self._onFileCompleted)
         CuraApplication.getInstance().getController().getScene().sceneChanged.connect(self._onSceneChanged)
         CuraApplication.getInstance().getPreferences().preferenceChanged.connect(self._onPreferencesChanged)
+        Logger.log("d", "OrientationPlugin started in %.3f s, the orientation engine is %s", time() - start_time,
+                   "loaded" if TweakEngine.is_loaded() else "deferred")
+
+    def _warmUp(self) -> None:
+        # Called once Cura has started, the warm-up itself runs in a job thread.
+        if "warm_up" not in TweakEngine.timings():
+            WarmUpJob(min_volume = CuraApplication.getInstance().getPreferences().getValue("OrientationPlugin/min_volume")).start()
 
     def _onPreferencesChanged(self, name: str) -> None:
+        if name == "OrientationPlugin/max_concurrent_jobs":
+            self._scheduler.setMaxJobs(int(CuraApplication.getInstance().getPreferences().getValue(name)))
         if name != "OrientationPlugin/do_auto_orientation":
             return
         self._do_auto_orientation = CuraApplication.getInstance().getPreferences().getValue("OrientationPlugin/do_auto_orientation")
@@ -82,25 +124,33 @@ class OrientationPlugin(Extension):
             CuraApplication.getInstance().callLater(self.checkQueuedNodes)
 
     def checkQueuedNodes(self):
-        for node in self._check_node_queue:
-            if self._message:
-                self._message.hide()
-            auto_orient_message = Message(i18n_catalog.i18nc("@info:status", "Auto-Calculating the optimal orientation because auto orientation is enabled"), 0,
-                                    False, -1, title=i18n_catalog.i18nc("@title", "Auto-Orientation"))
-            auto_orient_message.show()
-            job = CalculateOrientationJob([node], extended_mode=True, message=auto_orient_message)
-            job.finished.connect(self._onFinished)
-            job.start()
+        if not self._check_node_queue:
+            return
+        if self._message:
+            self._message.hide()
+        # The scheduler caps the concurrent jobs and calculates nodes with identical mesh data only once.
+        time_budget = float(CuraApplication.getInstance().getPreferences().getValue("OrientationPlugin/auto_orientation_time_budget"))
+        self._scheduler.schedule(self._check_node_queue, extended_mode = True, time_budget = time_budget if time_budget > 0 else None)
 
         self._check_node_queue = []
 
+    def getCacheStatistics(self):
+        """Returns the entries, hits and misses of the orientation cache, or None if the cache is disabled."""
+        if self._cache is None:
+            return None
+        return self._cache.statistics()
+
     def doFastAutoOrientation(self):
         self.doAutoOrientation(False)
 
     def doExtendedAutoOrientiation(self):
         self.doAutoOrientation(True)
 
-    def doAutoOrientation(self, extended_mode):
+    def doProgressiveAutoOrientation(self):
+        # Applies the fast orientation at once and keeps refining it with the extended mode.
+        self.doAutoOrientation(True, progressive = True)
+
+    def doAutoOrientation(self, extended_mode, progressive = False):
         # If we still had a message open from last time, hide it.
         if self._message:
             self._message.hide()
@@ -114,16 +164,32 @@ class OrientationPlugin(Extension):
         message = Message(i18n_catalog.i18nc("@info:status", "Calculating the optimal orientation..."), 0, False, -1, title = i18n_catalog.i18nc("@title", "Auto-Orientation"))
         message.show()
 
-        job = CalculateOrientationJob(selected_nodes, extended_mode = extended_mode, message = message)
+        job = CalculateOrientationJob(selected_nodes, extended_mode = extended_mode, message = message, cache = self._cache, progressive = progressive)
+        self._addCancelAction(message, job)
         job.finished.connect(self._onFinished)
         job.start()
 
+    def _addCancelAction(self, message: Message, job: CalculateOrientationJob) -> None:
+        message.addAction("cancel", i18n_catalog.i18nc("@action:button", "Cancel"), "",
+                          i18n_catalog.i18nc("@info:tooltip", "Stop the calculation, objects that are already oriented keep their orientation."))
+        self._cancellable_jobs[message] = job
+        message.actionTriggered.connect(self._onMessageActionTriggered)
+
+    def _onMessageActionTriggered(self, message: Message, action: str) -> None:
+        job = self._cancellable_jobs.get(message)
+        if job is not None and action == "cancel":
+            job.cancel()
+
     def _onFinished(self, job):
+        self._cancellable_jobs.pop(job.getMessage(), None)
         if self._message:
             self._message.hide()
 
         if job.getMessage() is not None:
             job.getMessage().hide()
-            self._message = Message(i18n_catalog.i18nc("@info:status", "All selected objects have been oriented."),
-                                    title=i18n_catalog.i18nc("@title", "Auto-Orientation"))
+            if job.isCancelled():
+                text = i18n_catalog.i18nc("@info:status", "The calculation of the orientation was cancelled.")
+            else:
+                text = i18n_catalog.i18nc("@info:status", "All selected objects have been oriented.")
+            self._message = Message(text, title=i18n_catalog.i18nc("@title", "Auto-Orientation"))
             self._message.show()
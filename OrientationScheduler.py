@@ -0,0 +1,158 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from UM.Logger import Logger
+from UM.Message import Message
+from UM.Scene.SceneNode import SceneNode
+from cura.CuraApplication import CuraApplication
+
+from .CalculateOrientationJob import CalculateOrientationJob
+from .NodeKeyJob import NodeKeyJob
+from .OrientationCache import OrientationCache
+
+from UM.i18n import i18nCatalog
+i18n_catalog = i18nCatalog("OrientationPlugin")
+
+
+class OrientationScheduler:
+    """Orients scheduled nodes with a bounded amount of concurrent jobs.
+
+    Nodes with identical mesh data and scale, e.g. multiplied parts, share a key and are oriented by a single
+    calculation, whose result is applied to each of them. A key is never calculated by two jobs at once, nodes that
+    arrive while their key is being calculated wait for the result. All scheduled nodes share one progress message.
+    The keys are computed once, in a NodeKeyJob, and handed over to the CalculateOrientationJob.
+    """
+
+    def __init__(self, cache = None, max_jobs = 2):
+        self._cache = cache  # type: Optional[OrientationCache]
+        self._max_jobs = max(1, max_jobs)
+        # The jobs that compute the keys of scheduled nodes, with the min_volume preference, the extended mode and the
+        # time budget of their calculation.
+        self._hashing = {}  # type: Dict[NodeKeyJob, Tuple[bool, bool, Optional[float]]]
+        # The nodes that are not started yet by key, with the settings of their calculation.
+        self._pending = OrderedDict()  # type: OrderedDict[str, Tuple[bool, bool, Optional[float], List[SceneNode]]]
+        self._running = {}  # type: Dict[CalculateOrientationJob, str]
+        self._progress = {}  # type: Dict[CalculateOrientationJob, float]
+        # The rankings of the current run in the frame of the mesh, shared by its jobs.
+        self._rankings = {}  # type: Dict[str, list]
+        self._total_nodes = 0
+        self._finished_nodes = 0
+        self._cancelled = False
+        self._message = None  # type: Optional[Message]
+        self._result_message = None  # type: Optional[Message]
+
+    def setMaxJobs(self, max_jobs: int) -> None:
+        self._max_jobs = max(1, max_jobs)
+        self._startJobs()
+
+    def schedule(self, nodes: List[SceneNode], extended_mode = True, time_budget = None) -> None:
+        """Queues the nodes for orientation, they are added to the running calculation if there is one.
+        Their keys are computed in the background, the nodes are queued by key as soon as these are known."""
+        min_volume = CuraApplication.getInstance().getPreferences().getValue("OrientationPlugin/min_volume")
+        job = NodeKeyJob(nodes, min_volume = min_volume, extended_mode = extended_mode)
+        self._hashing[job] = (min_volume, extended_mode, time_budget)
+        self._total_nodes += len(nodes)
+        self._showMessage()
+        job.finished.connect(self._onKeysFinished)
+        job.start()
+
+    def _onKeysFinished(self, job: NodeKeyJob) -> None:
+        if job not in self._hashing:  # cancelled meanwhile
+            return
+        min_volume, extended_mode, time_budget = self._hashing.pop(job)
+        keys = job.getResult()
+        if keys is None:
+            Logger.log("w", "Computing the keys of %d objects failed, they are not oriented", len(job.getNodes()))
+            self._finished_nodes += len(job.getNodes())
+        else:
+            for node in job.getNodes():
+                if keys[node] not in self._pending:
+                    self._pending[keys[node]] = (min_volume, extended_mode, time_budget, [])
+                self._pending[keys[node]][3].append(node)
+            Logger.log("d", "Scheduled %d objects for orientation, %d distinct meshes are waiting", len(keys), len(self._pending))
+        self._startJobs()
+        self._finishIfDone()
+
+    def cancel(self) -> None:
+        """Cancels the running jobs and drops the nodes that are not started yet."""
+        self._cancelled = True
+        self._hashing.clear()
+        self._pending.clear()
+        for job in list(self._running):
+            job.cancel()
+        self._finishIfDone()
+
+    def _startJobs(self) -> None:
+        while not self._cancelled and len(self._running) < self._max_jobs:
+            running_keys = set(self._running.values())
+            key = next((key for key in self._pending if key not in running_keys), None)
+            if key is None:
+                return
+            min_volume, extended_mode, time_budget, nodes = self._pending.pop(key)
+            job = CalculateOrientationJob(nodes, extended_mode = extended_mode, cache = self._cache, time_budget = time_budget,
+                                          rankings = self._rankings, progress_callback = self._onJobProgress,
+                                          keys = {node: key for node in nodes}, min_volume = min_volume)
+            self._running[job] = key
+            self._progress[job] = 0
+            job.finished.connect(self._onJobFinished)
+            job.start()
+
+    def _onJobProgress(self, job: CalculateOrientationJob, progress: float) -> None:
+        self._progress[job] = progress
+        self._updateProgress()
+
+    def _onJobFinished(self, job: CalculateOrientationJob) -> None:
+        if job not in self._running:
+            return
+        del self._running[job]
+        del self._progress[job]
+        self._finished_nodes += len(job.getNodes())
+        self._updateProgress()
+        self._startJobs()
+        self._finishIfDone()
+
+    def _finishIfDone(self) -> None:
+        if not self._running and not self._hashing and (self._cancelled or not self._pending):
+            self._finish()
+
+    def _updateProgress(self) -> None:
+        if self._message is None or self._total_nodes == 0:
+            return
+        # Each job contributes to the progress in proportion to its amount of nodes.
+        running = sum(len(job.getNodes()) * progress / 100 for job, progress in list(self._progress.items()))
+        self._message.setProgress(100 * (self._finished_nodes + running) / self._total_nodes)
+
+    def _showMessage(self) -> None:
+        if self._message is not None:
+            return
+        if self._result_message is not None:
+            self._result_message.hide()
+            self._result_message = None
+        self._message = Message(i18n_catalog.i18nc("@info:status", "Auto-Calculating the optimal orientation because auto orientation is enabled"), 0,
+                                False, -1, title = i18n_catalog.i18nc("@title", "Auto-Orientation"))
+        self._message.addAction("cancel", i18n_catalog.i18nc("@action:button", "Cancel"), "",
+                                i18n_catalog.i18nc("@info:tooltip", "Stop the calculation, objects that are already oriented keep their orientation."))
+        # Signals only hold weak references to their functions, so a bound method is connected instead of a lambda.
+        self._message.actionTriggered.connect(self._onMessageActionTriggered)
+        self._message.show()
+
+    def _onMessageActionTriggered(self, message: Message, action: str) -> None:
+        if action == "cancel":
+            self.cancel()
+
+    def _finish(self) -> None:
+        if self._message is not None:
+            self._message.hide()
+            self._message = None
+        if self._cancelled:
+            text = i18n_catalog.i18nc("@info:status", "The calculation of the orientation was cancelled.")
+        else:
+            text = i18n_catalog.i18nc("@info:status", "All loaded objects have been oriented.")
+        self._result_message = Message(text, title = i18n_catalog.i18nc("@title", "Auto-Orientation"))
+        self._result_message.show()
+        Logger.log("d", "Auto-orientation of %d objects finished, %d distinct meshes were calculated", self._finished_nodes, len(self._rankings))
+
+        self._total_nodes = 0
+        self._finished_nodes = 0
+        self._cancelled = False
+        self._rankings = {}
@@ -27,11 +27,24 @@ UM.Dialog
 
     title: "Auto orientation plugin settings"
 
-    CheckBox
+    Column
     {
-        checked: boolCheck(UM.Preferences.getValue("OrientationPlugin/do_auto_orientation"))
-        onClicked: UM.Preferences.setValue("OrientationPlugin/do_auto_orientation", checked)
+        anchors.fill: parent
 
-        text: "Automatically calculate the orientation for all loaded models"
+        CheckBox
+        {
+            checked: boolCheck(UM.Preferences.getValue("OrientationPlugin/do_auto_orientation"))
+            onClicked: UM.Preferences.setValue("OrientationPlugin/do_auto_orientation", checked)
+
+            text: "Automatically calculate the orientation for all loaded models"
+        }
+
+        CheckBox
+        {
+            checked: boolCheck(UM.Preferences.getValue("OrientationPlugin/warm_up"))
+            onClicked: UM.Preferences.setValue("OrientationPlugin/warm_up", checked)
+
+            text: "Prepare the calculation in the background after Cura has started"
+        }
     }
 }
\ No newline at end of file
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+
+# Layout of a triangle in a binary STL file, after the 80 byte header and the 4 byte triangle count
+STL_HEADER_SIZE = 84
+STL_RECORD = np.dtype([("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attribute", "<u2")])
+
+
+def is_binary_stl(path):
+    """Checks whether the file is a binary STL, by comparing its size with the triangle count of the header.
+    The leading "solid" keyword can't be used, as some exporters also write it into binary files.
+    """
+    size = os.path.getsize(path)
+    if size < STL_HEADER_SIZE:
+        return False
+    with open(path, "rb") as stl_file:
+        stl_file.seek(80)
+        count = int(np.frombuffer(stl_file.read(4), dtype="<u4")[0])
+    return size == STL_HEADER_SIZE + count * STL_RECORD.itemsize
+
+
+def map_binary_stl(path):
+    """Memory-maps the triangles of a binary STL file without reading or copying them.
+    Args:
+        path (string): path of the binary STL file.
+    Returns:
+        read-only structured array with the fields "normal" (3), "vertices" (3 x 3) and "attribute", which can be
+        passed to Tweak as it is. The pages of the file are only read when the Tweaker preprocesses them.
+    """
+    count = (os.path.getsize(path) - STL_HEADER_SIZE) // STL_RECORD.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=STL_RECORD)
+    return np.memmap(path, dtype=STL_RECORD, mode="r", offset=STL_HEADER_SIZE, shape=(count,))
+
+
+def read_ascii_stl(path):
+    """Reads the vertices of an ASCII STL file.
+    Args:
+        path (string): path of the ASCII STL file.
+    Returns:
+        vertices (np.array): with format 3 * face_count x 3.
+    """
+    vertices = list()
+    with open(path, "r", errors="replace") as stl_file:
+        for line in stl_file:
+            words = line.split()
+            if len(words) == 4 and words[0] == "vertex":
+                vertices.append([float(x) for x in words[1:]])
+    return np.array(vertices, dtype=np.float64).reshape(-1, 3)
+
+
+def load_stl(path):
+    """Loads a binary or an ASCII STL file, binary files are memory-mapped, see map_binary_stl."""
+    if is_binary_stl(path):
+        return map_binary_stl(path)
+    return read_ascii_stl(path)
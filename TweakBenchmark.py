@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""Headless benchmark of the phases of the MeshTweaker.
+
+The benchmark generates deterministic synthetic meshes, orients each of them in fast and extended mode, with and
+without min_volume, and records the wall time of each phase and the peak memory of the Tweaker. The phases are timed
+in their own runs, as tracing the memory slows down every allocation. With --lod-faces, it also records whether the
+coarse-to-fine mode chooses the orientation of a full evaluation. The results are written as JSON and can be
+compared to a stored baseline, e.g.:
+
+    python TweakBenchmark.py --sizes 1000 10000 --output baseline.json
+    python TweakBenchmark.py --sizes 1000 10000 --baseline baseline.json --tolerance 0.25
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import tracemalloc
+from time import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from MeshTweaker import Tweak  # noqa: E402
+from TweakKernels import get_backend  # noqa: E402
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000, 5000000)
+# Time differences below this amount of seconds are considered as noise and never reported as regression
+NOISE_FLOOR = 0.05
+
+
+def _quads(corners):
+    """Splits quads into two triangles each.
+    Args:
+        corners (np.array): the corners of the quads in cyclic order with format quad_count x 4 x 3.
+    Returns:
+        the triangles with format 2 * quad_count * 3 x 3.
+    """
+    triangles = np.concatenate([corners[:, [0, 1, 2]], corners[:, [0, 2, 3]]], axis=1)
+    return triangles.reshape(-1, 3)
+
+
+def _grid(function, u_count, v_count):
+    """Triangulates the parametric surface function(u, v) on a u_count x v_count grid of the unit square."""
+    u, v = np.meshgrid(np.linspace(0, 1, u_count + 1), np.linspace(0, 1, v_count + 1), indexing="ij")
+    points = function(u, v)  # (u_count + 1) x (v_count + 1) x 3
+    corners = np.stack([points[:-1, :-1], points[1:, :-1], points[1:, 1:], points[:-1, 1:]], axis=2)
+    return _quads(corners.reshape(-1, 4, 3))
+
+
+def sphere(face_count, radius=20.):
+    """UV sphere, the faces at the poles are degenerated and removed by the Tweaker."""
+    rings = max(2, int(round(np.sqrt(face_count / 4))))
+
+    def surface(u, v):
+        theta, phi = np.pi * u, 2 * np.pi * v
+        return radius * np.stack([np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta)], axis=-1)
+    return _grid(surface, rings, 2 * rings)
+
+
+def box(face_count, size=(40., 30., 20.)):
+    """Cuboid, each side is subdivided into a grid."""
+    cells = max(1, int(round(np.sqrt(face_count / 12))))
+    size = np.asarray(size)
+    sides = list()
+    for axis in range(3):
+        for side in (0., 1.):
+            def surface(u, v):
+                point = [np.full_like(u, side)] * 3
+                # in cyclic order of the axes the normal points along the axis, the near side is swapped
+                point[(axis + 1) % 3], point[(axis + 2) % 3] = (u, v) if side else (v, u)
+                return np.stack(point, axis=-1) * size
+            sides.append(_grid(surface, cells, cells))
+    return np.concatenate(sides)
+
+
+def lattice(face_count, pitch=5., size=3.):
+    """Cubic lattice of separated small cubes, 12 faces each."""
+    count = max(1, int(round((face_count / 12) ** (1 / 3))))
+    cube = box(12, (size, size, size))
+    offsets = pitch * np.stack(np.meshgrid(*[np.arange(count)] * 3, indexing="ij"), axis=-1).reshape(-1, 1, 3)
+    return (cube[None] + offsets).reshape(-1, 3)
+
+
+def noisy_scan(face_count, radius=20., noise=0.02, seed=0):
+    """Sphere with deterministic radial noise that is cut flat at the bottom, like a scan of an object on a table."""
+    mesh = sphere(face_count, radius).reshape(-1, 3, 3)
+    random = np.random.RandomState(seed)
+    # the noise is a function of the position, so the faces of the mesh stay connected
+    scale = 1 + noise * np.sin(mesh @ random.normal(size=(3, 8)) / radius * 7).sum(axis=-1, keepdims=True) / 4
+    mesh = mesh * scale
+    mesh[..., 2] = np.maximum(mesh[..., 2], -0.6 * radius)
+    return mesh.reshape(-1, 3)
+
+
+SHAPES = {"sphere": sphere, "box": box, "lattice": lattice, "noisy_scan": noisy_scan}
+
+
+def run_case(mesh, extended_mode, min_volume, repeat=1, **kwargs):
+    """Orients the mesh repeat times and measures the phases, the fastest run is kept. The peak memory is measured
+    in a separate run, as tracing the allocations slows them down.
+    Returns:
+        dict with the phase times, the peak memory in bytes and the best orientation. With lod_faces, also the
+        statistics of the coarse-to-fine mode and whether its orientation agrees with a full evaluation.
+    """
+    tweak = None
+    for _ in range(repeat):
+        candidate = Tweak(mesh, extended_mode=extended_mode, min_volume=min_volume, verbose=False, **kwargs)
+        if tweak is None or candidate.stats.phase_times["total"] < tweak.stats.phase_times["total"]:
+            tweak = candidate
+
+    tracemalloc.start()
+    try:
+        Tweak(mesh, extended_mode=extended_mode, min_volume=min_volume, verbose=False, **kwargs)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    result = {"phases": tweak.stats.phase_times, "peak_memory": peak_memory, "stats": tweak.stats.as_dict(),
+              "alignment": [float(x) for x in tweak.alignment], "unprintability": float(tweak.unprintability)}
+    if kwargs.get("lod_faces") is not None:
+        result["lod"] = compare_lod(tweak, Tweak(mesh, extended_mode=extended_mode, min_volume=min_volume,
+                                                 verbose=False, **dict(kwargs, lod_faces=None)))
+    return result
+
+
+def compare_lod(tweak, full):
+    """Compares the orientation of the coarse-to-fine mode with that of a full evaluation. A different orientation
+    with the same unprintability, e.g. another side of a box, agrees as well.
+    Returns:
+        dict with the coarse-to-fine statistics, the unprintability of the full evaluation and whether they agree,
+        or None if the mesh was too small for the coarse-to-fine mode.
+    """
+    if tweak.lod is None:
+        return None
+    lod = {key: value for key, value in tweak.lod.items() if key != "ranking"}
+    lod["full_alignment"] = [float(x) for x in full.alignment]
+    lod["full_unprintability"] = float(full.unprintability)
+    lod["agrees"] = bool(np.allclose(tweak.alignment, full.alignment) or
+                         np.isclose(tweak.unprintability, full.unprintability, rtol=1e-9, atol=0))
+    return lod
+
+
+def run(shapes, sizes, repeat=1, **kwargs):
+    """Runs all cases, for repeat > 1 the fastest run of each case is kept.
+    Returns:
+        list of the results, see run_case, with the shape, face count and mode of each case.
+    """
+    results = list()
+    for shape in shapes:
+        for size in sizes:
+            mesh = SHAPES[shape](size)
+            for extended_mode in (False, True):
+                for min_volume in (False, True):
+                    result = run_case(mesh, extended_mode, min_volume, repeat=repeat, **kwargs)
+                    result.update(shape=shape, size=size, faces=len(mesh) // 3, extended_mode=extended_mode,
+                                  min_volume=min_volume)
+                    results.append(result)
+                    lod = result.get("lod")
+                    print("{shape:<11s}{faces:>9d} faces  extended={extended_mode:d} min_volume={min_volume:d}  "
+                          "{total:8.3f} s  {memory:8.1f} MiB{agreement}".format(
+                              total=result["phases"]["total"], memory=result["peak_memory"] / 2 ** 20,
+                              agreement="" if lod is None else "  coarse-to-fine {}, saved {:.3f} s".format(
+                                  "agrees" if lod["agrees"] else "DISAGREES", lod["time_saved"]), **result))
+    return results
+
+
+def _case_key(result):
+    return result["shape"], result["size"], result["extended_mode"], result["min_volume"]
+
+
+def compare(results, baseline, tolerance):
+    """Compares the results to the baseline.
+    Args:
+        results (list): results of run.
+        baseline (list): stored results of run.
+        tolerance (float): allowed relative increase of the time of each phase and of the peak memory.
+    Returns:
+        list of messages, one per regression.
+    """
+    reference = {_case_key(result): result for result in baseline}
+    regressions = list()
+    for result in results:
+        old = reference.get(_case_key(result))
+        if old is None:
+            continue
+        name = "{} {} faces extended={:d} min_volume={:d}".format(result["shape"], result["faces"],
+                                                                  result["extended_mode"], result["min_volume"])
+        for phase, seconds in result["phases"].items():
+            previous = old["phases"].get(phase, seconds)
+            if seconds > previous * (1 + tolerance) and seconds - previous > NOISE_FLOOR:
+                regressions.append("{}: {} took {:.3f} s instead of {:.3f} s".format(name, phase, seconds, previous))
+        if result["peak_memory"] > old["peak_memory"] * (1 + tolerance):
+            regressions.append("{}: peak memory {:.1f} MiB instead of {:.1f} MiB".format(
+                name, result["peak_memory"] / 2 ** 20, old["peak_memory"] / 2 ** 20))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the phases of the MeshTweaker on synthetic meshes.")
+    parser.add_argument("--shapes", nargs="+", choices=sorted(SHAPES), default=sorted(SHAPES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES, help="approximate face counts")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per case, the fastest one is kept")
+    parser.add_argument("--backend", choices=["numpy", "numba"], default=None, help="kernels of the lithography")
+    parser.add_argument("--memory-budget", type=float, default=None,
+                        help="memory budget of the Tweaker in MiB, larger meshes are evaluated in chunks")
+    parser.add_argument("--branch-and-bound", action="store_true",
+                        help="skip the orientations whose lower bound exceeds the best one found")
+    parser.add_argument("--sweep-regions", type=int, default=None,
+                        help="also evaluate the best regions of a dense sweep over all directions")
+    parser.add_argument("--lod-faces", type=int, default=None,
+                        help="score the candidates on a sample of this many faces first, see Tweak.coarse_to_fine, "
+                             "and record whether the orientation agrees with a full evaluation")
+    parser.add_argument("--lod-top-k", type=int, default=8, help="candidates re-scored on the full mesh")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="fail if the results are slower than this stored JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    args = parser.parse_args(argv)
+
+    memory_budget = None if args.memory_budget is None else int(args.memory_budget * 2 ** 20)
+    results = run(args.shapes, args.sizes, repeat=args.repeat, backend=args.backend, memory_budget=memory_budget,
+                  branch_and_bound=args.branch_and_bound, sweep_regions=args.sweep_regions, lod_faces=args.lod_faces,
+                  lod_top_k=args.lod_top_k)
+    report = {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+              "backend": get_backend(args.backend).name, "time": time(), "results": results}
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline)["results"], args.tolerance)
+        for regression in regressions:
+            print("Regression: " + regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
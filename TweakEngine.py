@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Deferred loading of the orientation engine.
+
+The MeshTweaker, its kernels and their optional dependencies (numba, scipy) are only imported when the first
+orientation is calculated, so they don't slow down the start of Cura. warm_up runs a tiny mesh through the Tweaker,
+e.g. in a background thread once Cura is idle, so the first orientation doesn't pay the cold start either.
+"""
+import threading
+from time import time
+
+import numpy as np
+
+# Corners and faces of a cube, the smallest mesh that runs through all phases of the Tweaker
+WARM_UP_POINTS = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+                           [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1]], dtype=np.float32) * 10
+WARM_UP_FACES = np.array([[0, 2, 1], [0, 3, 2], [4, 5, 6], [4, 6, 7], [0, 1, 5], [0, 5, 4],
+                          [1, 2, 6], [1, 6, 5], [2, 3, 7], [2, 7, 6], [3, 0, 4], [3, 4, 7]], dtype=np.int32)
+
+_lock = threading.Lock()
+_engine = None
+_workers = None
+_timings = dict()
+
+
+def load():
+    """Imports the MeshTweaker on the first call, later calls return it at once. Thread-safe.
+    Returns:
+        the MeshTweaker module.
+    """
+    global _engine
+    with _lock:
+        if _engine is None:
+            t_start = time()
+            try:
+                from . import MeshTweaker
+            except ImportError:  # imported outside of the plugin package, e.g. headless
+                import MeshTweaker
+            _engine = MeshTweaker
+            _timings["import"] = time() - t_start
+    return _engine
+
+
+def load_workers():
+    """Imports the TweakWorkers on the first call, they import the MeshTweaker, see load.
+    Returns:
+        the TweakWorkers module.
+    """
+    global _workers
+    load()
+    with _lock:
+        if _workers is None:
+            try:
+                from . import TweakWorkers
+            except ImportError:  # imported outside of the plugin package, e.g. headless
+                import TweakWorkers
+            _workers = TweakWorkers
+    return _workers
+
+
+def is_loaded():
+    """Returns whether the MeshTweaker is imported already."""
+    return _engine is not None
+
+
+def warm_up(min_volume=False):
+    """Orients a cube in the fast and the extended mode, so that everything that is initialized on first use, e.g.
+    the compilation of the numba kernels, is ready before the first real orientation. The cost is recorded in the
+    timings as "warm_up".
+    Args:
+        min_volume (bool): the mode of the target function that is used afterwards.
+    Returns:
+        the seconds of the warm-up, without the import.
+    """
+    engine = load()
+    t_start = time()
+    for extended_mode in (False, True):
+        engine.Tweak(WARM_UP_POINTS, indices=WARM_UP_FACES, extended_mode=extended_mode, verbose=False,
+                     min_volume=min_volume)
+    _timings["warm_up"] = time() - t_start
+    return _timings["warm_up"]
+
+
+def record_first_call(seconds):
+    """Records the latency of the first orientation, later calls are ignored.
+    Returns:
+        whether it was the first call.
+    """
+    with _lock:
+        if "first_call" in _timings:
+            return False
+        _timings["first_call"] = seconds
+    return True
+
+
+def timings():
+    """Returns the measured seconds of the "import", the "warm_up" and the "first_call", as far as they happened."""
+    with _lock:
+        return dict(_timings)
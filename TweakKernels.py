@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+from types import SimpleNamespace
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # numba is optional, the NumPy reference kernels are used without it
+    numba = None
+
+
+def jit(function):
+    """Compiles the function with numba if it is installed, the compiled code is cached on disk if possible."""
+    if numba is None:
+        return function
+    try:
+        return numba.njit(cache=True, nogil=True)(function)
+    except RuntimeError:  # no writable cache location
+        return numba.njit(nogil=True)(function)
+
+
+# Relative tolerance of the fused kernels against the reference, they sum in a different order
+PARITY_RTOL = 1e-6
+# Bytes per point that the fused kernel allocates for the projection onto an orientation
+PROJECTED_POINT_BYTES = 8
+
+
+def project_onto(points, orientations):
+    """Project points onto a single orientation vector or onto a block of orientation vectors.
+    The dot products are spelled out element-wise, so that a block of orientations yields bitwise the same
+    values as projecting onto each orientation on its own (BLAS kernels differ by the shape of the block).
+    Args:
+        points (np.array): with format ... x 3.
+        orientations (np.array): with format 3 or K x 3.
+    Returns:
+        the projections with format ... or K x ...
+    """
+    orientations = np.asarray(orientations, dtype=points.dtype)
+    if orientations.ndim == 1:
+        return points[..., 0] * orientations[0] + points[..., 1] * orientations[1] + \
+            points[..., 2] * orientations[2]
+    shape = (len(orientations),) + (1,) * (points.ndim - 1)
+    return points[..., 0] * orientations[:, 0].reshape(shape) + points[..., 1] * orientations[:, 1].reshape(shape) + \
+        points[..., 2] * orientations[:, 2].reshape(shape)
+
+
+class NumpyKernels:
+    """ Reference kernels, each quantity is computed for a whole block of orientations in vectorized passes. """
+
+    name = "numpy"
+    # whether the kernels use the per-face constants that Tweak.lithography caches, see CompactMesh.cache_face_constants
+    face_constants = True
+
+    @staticmethod
+    def calc_overhang_block(settings, mesh, orientations, min_volume, chunk_size=None):
+        """Calculating bottom and overhang area as well as the contour length for a block of orientations.
+        With a chunk_size, the faces are evaluated out-of-core in chunks, so only the intermediates of a chunk are
+        alive: a first pass finds the lowest point of each orientation, the second one sums up the features. As
+        these passes take long on large meshes, the cancellation is checked for each chunk.
+        Args:
+            settings (Tweak): provides the parameters of the target function, extended_mode and check_cancelled.
+            mesh (CompactMesh): the mesh to evaluate.
+            orientations (np.array): with format K x 3.
+            min_volume (bool): minimize the support material volume or supported surfaces
+            chunk_size (int): optional amount of faces that are evaluated at once.
+        Returns:
+            list of K tuples (bottom, overhang, contour), equal to those of Tweak.calc_overhang, in chunks up to
+            the order of the summation.
+        """
+        if chunk_size is None or chunk_size >= len(mesh):
+            sums, bottom_edges = NumpyKernels.sum_features(settings, mesh, orientations, min_volume)
+        else:
+            total_mins = np.full(len(orientations), np.inf)
+            for chunk in mesh.chunks(chunk_size):
+                settings.check_cancelled()
+                total_mins = np.minimum(total_mins, np.amin(chunk.project(orientations), axis=(1, 2)))
+            sums = np.zeros((len(orientations), 4))
+            chunk_edges = list()
+            for chunk in mesh.chunks(chunk_size):
+                settings.check_cancelled()
+                chunk_sums, edges = NumpyKernels.sum_features(settings, chunk, orientations, min_volume, total_mins)
+                sums += chunk_sums
+                chunk_edges.append(edges)
+            bottom_edges = [np.concatenate([edges[k] for edges in chunk_edges]) for k in range(len(chunk_edges[0]))]
+
+        features = list()
+        for k in range(len(orientations)):
+            bottom, overhang, contour, touching = sums[k]
+            if not settings.extended_mode:  # consider the bottom area as square, bottom=a**2 ^ contour=4*a
+                contour = 4 * np.sqrt(bottom)
+            else:
+                if settings.exact_contour:
+                    contour = mesh.boundary_length_of(bottom_edges[k])
+                if touching > 0:
+                    contour += settings.CONTOUR_AMOUNT
+            features.append((bottom, overhang, contour))
+        return features
+
+    @staticmethod
+    def sum_features(settings, mesh, orientations, min_volume, total_mins=None):
+        """Summing up the features of the faces of a mesh or of a chunk of faces for a block of orientations.
+        Args:
+            settings (Tweak): provides the parameters of the target function and extended_mode.
+            mesh (CompactMesh): the faces to evaluate.
+            orientations (np.array): with format K x 3.
+            min_volume (bool): minimize the support material volume or supported surfaces
+            total_mins (np.array): the lowest point of the whole mesh per orientation, by default that of the faces.
+        Returns:
+            the sums with format K x 4 of bottom, overhang, the legacy contour and the amount of faces that touch
+            the bottom, and for the exact contour a list with the edges of the bottom faces of each orientation.
+        """
+        # the per-face constants are cached by Tweak.lithography, chunks compute them before the intermediates
+        legacy_contour = settings.extended_mode and not settings.exact_contour
+        centroids = mesh.face_centroids() if min_volume else None
+        lengths = mesh.opposite_edge_lengths() if legacy_contour else None
+        projected = mesh.project(orientations)  # K x face_count x 3
+        a, b, c = projected[..., 0], projected[..., 1], projected[..., 2]
+        proj_max = np.maximum(np.maximum(a, b), c)
+        if total_mins is None:
+            total_mins = np.amin(projected, axis=(1, 2))
+        # the thresholds are rounded like the scalar ones of Tweak.calc_overhang, which are compared in mesh.dtype
+        thresholds = (total_mins.astype(np.float64) + settings.FIRST_LAY_H).astype(mesh.dtype)[:, None]
+        alignments = project_onto(mesh.normals, orientations)  # K x face_count
+
+        sums = np.zeros((len(orientations), 4))
+        bottom_faces = proj_max < thresholds
+        sums[:, 0] = np.sum(np.where(bottom_faces, mesh.areas, 0), axis=1, dtype=np.float64)
+
+        overhanging = np.logical_and(alignments < settings.ASCENT, proj_max > thresholds)
+        del proj_max
+        inner = alignments - settings.ASCENT
+        if min_volume:
+            heights = project_onto(centroids, orientations) - total_mins.astype(mesh.dtype)[:, None]
+            terms = (settings.height_offset + settings.height_log * np.log(settings.height_log_k * heights + 1)) * \
+                mesh.areas * np.abs(inner * (inner < 0)) ** settings.OV_H
+            del heights
+            sums[:, 1] = np.sum(np.where(overhanging, terms, 0), axis=1, dtype=np.float64)
+        else:
+            terms = mesh.areas * np.abs(inner * (inner < 0)) ** 2
+            sums[:, 1] = 2 * np.sum(np.where(overhanging, terms, 0), axis=1, dtype=np.float64)
+        del inner, terms
+        if settings.extended_mode:
+            plafonds = np.logical_and(overhanging, (mesh.normals == -orientations[:, None, :]).all(axis=2))
+            sums[:, 1] -= settings.PLAFOND_ADV * np.sum(np.where(plafonds, mesh.areas, 0), axis=1, dtype=np.float64)
+        del alignments, overhanging
+
+        # filter the total length of the bottom area's contour
+        bottom_edges = list()
+        if settings.extended_mode and settings.exact_contour:
+            # the boundary of the bottom faces, see CompactMesh.boundary_length
+            bottom_edges = [mesh.face_edges[faces] for faces in bottom_faces]
+            sums[:, 3] = np.count_nonzero(bottom_faces, axis=1)
+        elif legacy_contour:
+            # the median is the middle of the three projections, the contour of a touching face is the edge between
+            # its two lowest vertices, which is opposite to the last one in the stable order by height
+            touching = np.maximum(np.minimum(a, b), np.minimum(np.maximum(a, b), c)) < thresholds
+            contours = np.where(c >= np.maximum(a, b), lengths[:, 2], np.where(b >= a, lengths[:, 1], lengths[:, 0]))
+            sums[:, 2] = np.sum(np.where(touching, contours, 0), axis=1, dtype=np.float64)
+            sums[:, 3] = np.count_nonzero(touching, axis=1)
+        return sums, bottom_edges
+
+
+@jit
+def _overhang_features(points, faces, normals, areas, orientation, extended_mode, min_volume, first_lay_h, ascent,
+                       plafond_adv, contour_amount, ov_h, height_offset, height_log, height_log_k, exact_contour,
+                       face_edges, edge_lengths):
+    """Fused kernel of the features of one orientation, it passes once over the points and twice over the faces
+    instead of creating the temporaries of the reference. See NumpyKernels.calc_overhang_block."""
+    o0, o1, o2 = orientation[0], orientation[1], orientation[2]
+    # the projections and the values they are compared with are rounded to the precision of the mesh, like those of
+    # the reference, so both pick the same faces and the same lowest corners
+    axis = np.empty_like(points[0])
+    axis[0], axis[1], axis[2] = o0, o1, o2
+    projected = np.empty_like(points[:, 0])
+    for i in range(len(points)):
+        projected[i] = points[i, 0] * axis[0] + points[i, 1] * axis[1] + points[i, 2] * axis[2]
+    # points that are not used by any face must not count, hence the minimum is taken over the faces
+    total_min = np.inf
+    for f in range(len(faces)):
+        for j in range(3):
+            total_min = min(total_min, projected[faces[f, j]])
+    bounds = np.empty_like(points[0, :2])
+    bounds[0], bounds[1] = total_min + first_lay_h, ascent
+    threshold, rounded_ascent = bounds[0], bounds[1]
+
+    bottom = 0.
+    overhang = 0.
+    plafond = 0.
+    contour = 0.
+    touching = 0
+    bottom_edges = np.zeros(len(edge_lengths), dtype=np.int32)  # amount of bottom faces of each edge
+    for f in range(len(faces)):
+        a = projected[faces[f, 0]]
+        b = projected[faces[f, 1]]
+        c = projected[faces[f, 2]]
+        highest = max(a, b, c)
+        if highest < threshold:
+            bottom += areas[f]
+            if exact_contour:
+                touching += 1
+                for j in range(3):
+                    bottom_edges[face_edges[f, j]] += 1
+
+        alignment = normals[f, 0] * axis[0] + normals[f, 1] * axis[1] + normals[f, 2] * axis[2]
+        if alignment < rounded_ascent and highest > threshold:
+            inner = ascent - alignment
+            if min_volume:
+                height = ((points[faces[f, 0], 0] + points[faces[f, 1], 0] + points[faces[f, 2], 0]) * o0 +
+                          (points[faces[f, 0], 1] + points[faces[f, 1], 1] + points[faces[f, 2], 1]) * o1 +
+                          (points[faces[f, 0], 2] + points[faces[f, 1], 2] + points[faces[f, 2], 2]) * o2) / 3 \
+                    - total_min
+                overhang += (height_offset + height_log * np.log(height_log_k * height + 1)) * areas[f] * inner ** ov_h
+            else:
+                overhang += 2 * areas[f] * inner ** 2
+            if extended_mode and normals[f, 0] == -o0 and normals[f, 1] == -o1 and normals[f, 2] == -o2:
+                plafond += areas[f]
+
+        if extended_mode and not exact_contour:
+            # stable order of the corners by height, like np.argsort, the median is the second lowest one
+            first = 0
+            if b < a:
+                first = 1
+            if c < (a, b)[first]:
+                first = 2
+            if first == 0:
+                second = 1 if b <= c else 2
+            elif first == 1:
+                second = 0 if a <= c else 2
+            else:
+                second = 0 if a <= b else 1
+            if (a, b, c)[second] < threshold:
+                touching += 1
+                length = 0.
+                for j in range(3):
+                    delta = points[faces[f, first], j] - points[faces[f, second], j]
+                    length += delta * delta
+                contour += length ** 0.5
+
+    overhang -= plafond_adv * plafond
+    if not extended_mode:
+        contour = 4 * np.sqrt(bottom)
+    elif exact_contour:
+        for e in range(len(edge_lengths)):
+            if bottom_edges[e] == 1:
+                contour += edge_lengths[e]
+    if extended_mode and touching > 0:
+        contour += contour_amount
+    return bottom, overhang, contour
+
+
+class NumbaKernels:
+    """ Fused kernels that are compiled by numba. Each orientation is evaluated in a single kernel call that
+    does not allocate more than the projected points, and releases the GIL while doing so. """
+
+    name = "numba"
+    face_constants = False
+
+    @staticmethod
+    def calc_overhang_block(settings, mesh, orientations, min_volume, chunk_size=None):
+        """See NumpyKernels.calc_overhang_block, the results equal those within PARITY_RTOL. The fused kernel only
+        allocates the projected points of one orientation at a time, the faces are only evaluated in chunks by the
+        NumPy kernels if even those exceed the memory budget."""
+        point_count = len(mesh.points) if mesh.indexed else 3 * len(mesh)
+        if chunk_size is not None and PROJECTED_POINT_BYTES * point_count > settings.memory_budget:
+            return NumpyKernels.calc_overhang_block(settings, mesh, orientations, min_volume, chunk_size)
+        if mesh.indexed:
+            points, faces = mesh.points, mesh.faces
+        else:
+            points = mesh.vertices.reshape(-1, 3)
+            faces = np.arange(len(points)).reshape(-1, 3)
+        exact_contour = settings.extended_mode and settings.exact_contour
+        if exact_contour:
+            face_edges, edge_lengths = mesh.face_edges, mesh.edge_lengths
+        else:  # typed placeholders, the kernel doesn't touch them
+            face_edges, edge_lengths = np.zeros((0, 3), dtype=np.intp), np.zeros(0)
+        features = list()
+        for orientation in np.asarray(orientations, dtype=np.float64):
+            features.append(_overhang_features(points, faces, mesh.normals, mesh.areas, orientation,
+                                               settings.extended_mode, min_volume, settings.FIRST_LAY_H,
+                                               settings.ASCENT, settings.PLAFOND_ADV, settings.CONTOUR_AMOUNT,
+                                               float(settings.OV_H), settings.height_offset, settings.height_log,
+                                               settings.height_log_k, exact_contour, face_edges, edge_lengths))
+        return features
+
+
+BACKENDS = {"numpy": NumpyKernels, "numba": NumbaKernels}
+_verified = dict()  # results of the parity checks, by name of the backend
+
+
+def available_backends():
+    """Returns the names of the backends whose dependencies are installed."""
+    return [name for name in BACKENDS if name != "numba" or numba is not None]
+
+
+def check_parity(kernels, rtol=PARITY_RTOL):
+    """Compares the kernels with the NumPy reference on a small mesh, for all modes of the Tweaker. It is a quick
+    self-check before a backend is used at runtime, tests/test_kernels.py compares them on realistic meshes.
+    Args:
+        kernels: the kernels to check, e.g. NumbaKernels.
+        rtol (float): relative tolerance of the features.
+    Returns:
+        whether all features are equal within the tolerance.
+    """
+    try:
+        from .MeshTweaker import CompactMesh, PARAMETER, PARAMETER_VOL
+    except ImportError:  # imported outside of the plugin package, e.g. headless
+        from MeshTweaker import CompactMesh, PARAMETER, PARAMETER_VOL
+
+    # a tetrahedron on top of a slanted prism, in generic position so the corners of a face have different heights
+    points = np.array([[0.1, 0.2, 0.05], [10.3, 0.4, 0.15], [5.2, 9.7, 0.1], [0.3, 0.1, 5.3], [10.1, 0.6, 6.4],
+                       [5.4, 9.9, 4.9], [5.1, 3.4, 12.2]])
+    faces = np.array([[0, 2, 1], [0, 1, 4], [0, 4, 3], [1, 2, 5], [1, 5, 4], [2, 0, 3], [2, 3, 5],
+                      [3, 4, 6], [4, 5, 6], [5, 3, 6]])
+    normals = np.cross(points[faces[:, 1]] - points[faces[:, 0]], points[faces[:, 2]] - points[faces[:, 0]])
+    areas = np.sqrt(np.sum(np.square(normals), axis=-1))
+    mesh = CompactMesh(normals / areas[:, None], None, areas / 2, points=points, faces=faces)
+    mesh.build_edges()
+    orientations = np.vstack([np.eye(3), -np.eye(3), -mesh.normals])
+
+    for parameter in (PARAMETER, PARAMETER_VOL):
+        for extended_mode, exact_contour in ((False, False), (True, False), (True, True)):
+            settings = SimpleNamespace(extended_mode=extended_mode, exact_contour=exact_contour,
+                                       check_cancelled=lambda: None, **parameter)
+            min_volume = parameter is PARAMETER_VOL
+            reference = NumpyKernels.calc_overhang_block(settings, mesh, orientations, min_volume)
+            features = kernels.calc_overhang_block(settings, mesh, orientations, min_volume)
+            if not np.allclose(features, reference, rtol=rtol, atol=0):
+                return False
+    return True
+
+
+def get_backend(name=None):
+    """Selects the kernels of the Tweaker at runtime. Backends whose dependency is missing, or that fail to compile
+    or to match the reference, fall back to the NumPy reference.
+    Args:
+        name (string): "numpy", "numba", or None for the fastest available backend.
+    Returns:
+        the kernels, NumpyKernels or NumbaKernels.
+    """
+    if name is not None and name not in BACKENDS:
+        raise ValueError("Unknown backend {}, choose one of {}".format(name, ", ".join(BACKENDS)))
+    if name is None:
+        name = "numba" if numba is not None else "numpy"
+    if name not in available_backends():
+        return NumpyKernels
+    if name != "numpy" and name not in _verified:
+        try:
+            _verified[name] = check_parity(BACKENDS[name])
+        except Exception:  # e.g. a failing compilation
+            _verified[name] = False
+    return BACKENDS[name] if _verified.get(name, True) else NumpyKernels
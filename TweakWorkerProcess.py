@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""The function that the worker processes of TweakWorkerPool run.
+
+The workers import this module by its top-level name, as the plugin directory is on their search path. Hence it
+doesn't import anything of the plugin package at module level, so the workers never run the package __init__ and
+with it Uranium, Cura and Qt, and the calling process can import it by the same name, see TweakWorkers.
+"""
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # shared memory blocks need Python 3.8 or newer
+    shared_memory = None
+
+
+class _SharedCancellationToken:
+    """ Cancellation token of a worker process, the calling process cancels it by setting a shared flag. """
+
+    def __init__(self, block):
+        self._block = block
+
+    @property
+    def cancelled(self):
+        return self._block.buf[0] != 0
+
+
+def tweak_shared_mesh(arrays, kwargs, cancel_flag):
+    """Runs the Tweaker in a worker process on a mesh that is stored in shared memory blocks.
+    Args:
+        arrays (list): (name, shape, dtype) of the shared memory blocks holding the vertices and, for indexed
+            meshes, the face indices.
+        kwargs (dict): keyword arguments for Tweak.
+        cancel_flag (string): name of the shared memory block whose first byte is set to cancel the Tweaker.
+    Returns:
+        the euler parameter [rotation axis, rotation angle] of the best orientation, the ranking of the
+        best alignments, see OrientationCache.to_ranking, and the statistics as dictionary, see TweakStats.
+        None if it was cancelled, as TweakCancelled of the top-level MeshTweaker can't be unpickled by the plugin.
+    """
+    from MeshTweaker import Tweak, TweakCancelled
+    from OrientationCache import to_ranking
+
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in arrays]
+    flag = shared_memory.SharedMemory(name=cancel_flag)
+    try:
+        views = [np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+                 for block, (_, shape, dtype) in zip(blocks, arrays)]
+        try:
+            result = Tweak(views[0], indices=views[1] if len(views) > 1 else None,
+                           cancel_token=_SharedCancellationToken(flag), **kwargs)
+            outcome = result.euler_parameter, to_ranking(result.best_5), result.stats.as_dict()
+            del result
+        except TweakCancelled:
+            outcome = None
+        del views  # the buffers can only be closed without exported views
+    finally:
+        for block in blocks + [flag]:
+            block.close()
+    return outcome
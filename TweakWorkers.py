@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import site
+import threading
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # shared memory blocks need Python 3.8 or newer
+    shared_memory = None
+
+try:
+    from .MeshTweaker import TweakCancelled
+except ImportError:  # imported outside of the plugin package, e.g. headless
+    from MeshTweaker import TweakCancelled
+
+# The worker processes import the modules of the plugin by their top-level names, so its directory is added to their
+# search path, see TweakWorkerProcess.
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKER_MODULE = "TweakWorkerProcess"
+# Seconds between two checks of the cancellation token while waiting for the workers
+CANCEL_POLL_INTERVAL = 0.1
+
+_lock = threading.Lock()
+_executor = None  # the worker processes, shared by all TweakWorkerPools with the same amount of processes
+_executor_processes = 0
+
+
+def is_available():
+    """Returns whether meshes can be handed to worker processes via shared memory. Frozen applications, like the
+    packaged Cura, are excluded: spawning a worker starts sys.executable, which is then the application itself."""
+    return shared_memory is not None and not getattr(sys, "frozen", False)
+
+
+def _worker_module():
+    """Returns TweakWorkerProcess by its top-level name, the name the workers unpickle its function by. Within the
+    plugin package it is loaded from the plugin directory without adding that to the search path."""
+    module = sys.modules.get(WORKER_MODULE)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(WORKER_MODULE, os.path.join(PLUGIN_DIR, WORKER_MODULE + ".py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[WORKER_MODULE] = module
+    return module
+
+
+def _get_executor(processes):
+    """Returns the pool of spawned worker processes, it is created on first use and reused by later calls, as
+    starting a worker imports NumPy and the Tweaker again."""
+    global _executor, _executor_processes
+    with _lock:
+        if _executor is None or _executor_processes != processes:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=site.addsitedir, initargs=(PLUGIN_DIR,))
+            _executor_processes = processes
+        return _executor
+
+
+def _discard_executor(executor):
+    """Drops a broken pool, the next call creates a new one."""
+    global _executor
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+class TweakWorkerPool:
+    """ Orients several meshes in parallel worker processes.
+
+    The vertex and index buffers are copied once into shared memory blocks, so they are not pickled, and
+    only the euler parameters, the small ranking of the best alignments and the statistics travel back to the
+    calling process. The workers are spawned, as forking a process that runs a GUI with several threads is unsafe,
+    and are kept for later calls. They run TweakWorkerProcess, which doesn't import the plugin package.
+    """
+
+    def __init__(self, processes=None):
+        self._processes = processes or os.cpu_count() or 1
+
+    def orient(self, meshes, cancel_token=None, **kwargs):
+        """Orients the meshes in the worker processes.
+        Args:
+            meshes (list): (vertices, indices) tuples of the meshes, indices is None for triangle soups.
+            cancel_token (CancellationToken): optional token, cancelling it stops the workers and raises
+                TweakCancelled.
+            kwargs: keyword arguments for Tweak.
+        Returns:
+            generator of (index, euler_parameter, ranking, stats) tuples in the order the meshes are finished.
+        """
+        if not is_available():
+            raise RuntimeError("Worker processes need multiprocessing.shared_memory (Python 3.8+) and a Python "
+                               "interpreter to spawn")
+        if len(meshes) == 0:
+            return
+
+        kwargs.setdefault("verbose", False)
+        tweak_shared_mesh = _worker_module().tweak_shared_mesh
+        cancel_flag = shared_memory.SharedMemory(create=True, size=1)
+        cancel_flag.buf[0] = 0
+        blocks = [cancel_flag]
+        futures = dict()
+        executor = _get_executor(self._processes)
+        try:
+            for index, (vertices, indices) in enumerate(meshes):
+                arrays = list()
+                for array in (vertices, indices):
+                    if array is None:
+                        continue
+                    array = np.ascontiguousarray(array)
+                    block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+                    blocks.append(block)
+                    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+                    shared[:] = array
+                    del shared
+                    arrays.append((block.name, array.shape, array.dtype.str))
+                futures[executor.submit(tweak_shared_mesh, arrays, kwargs, cancel_flag.name)] = index
+
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=CANCEL_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                if cancel_token is not None and cancel_token.cancelled:
+                    raise TweakCancelled()
+                for future in done:
+                    result = future.result()
+                    if result is None:  # only if the flag was set
+                        raise TweakCancelled()
+                    euler_parameter, ranking, stats = result
+                    yield futures[future], euler_parameter, ranking, stats
+        except BrokenProcessPool:
+            _discard_executor(executor)
+            raise
+        finally:
+            # the results are not wanted anymore, e.g. after a cancellation or an error, the running workers stop at
+            # their next check and the blocks are only released once none of them uses them
+            cancel_flag.buf[0] = 1
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            for block in blocks:
+                block.close()
+                block.unlink()
@@ -0,0 +1,21 @@
+from UM.Job import Job
+from UM.Logger import Logger
+
+from . import TweakEngine
+
+
+class WarmUpJob(Job):
+    """Imports the orientation engine and orients a tiny mesh in the background, so the first orientation of the user
+    doesn't pay the cold start, see TweakEngine.warm_up."""
+
+    def __init__(self, min_volume = False):
+        super().__init__()
+        self._min_volume = min_volume
+
+    def run(self):
+        try:
+            TweakEngine.warm_up(self._min_volume)
+        except Exception:
+            Logger.logException("w", "Warming up the orientation engine failed")
+            return
+        Logger.log("d", "Warmed up the orientation engine, timings: %s", TweakEngine.timings())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of the plugin are imported as top-level modules, like the headless tools do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Deterministic reference meshes of the tests, as face_count x 3 x 3 vertices."""
+import numpy as np
+
+
+def rotation(seed):
+    """Returns a random rotation matrix, drawn from the seed."""
+    q, r = np.linalg.qr(np.random.RandomState(seed).normal(size=(3, 3)))
+    q = q * np.sign(np.diag(r))
+    return q * np.sign(np.linalg.det(q))
+
+
+def box(size=(30., 20., 10.), subdivisions=6, origin=(0., 0., 0.)):
+    """A box whose sides are subdivided into a grid of triangles, like a meshed CAD part."""
+    origin = np.asarray(origin, dtype=np.float64)
+    x, y, z = np.diag(np.asarray(size, dtype=np.float64))
+    faces = list()
+    for corner, u, v in ((origin, y, x), (origin + z, x, y), (origin, x, z), (origin + y, z, x), (origin, z, y),
+                         (origin + x, y, z)):
+        for i in range(subdivisions):
+            for j in range(subdivisions):
+                a = corner + (u * i + v * j) / subdivisions
+                b = corner + (u * (i + 1) + v * j) / subdivisions
+                c = corner + (u * (i + 1) + v * (j + 1)) / subdivisions
+                d = corner + (u * i + v * (j + 1)) / subdivisions
+                faces += [[a, b, c], [a, c, d]]
+    return np.array(faces)
+
+
+def bracket():
+    """An L-shaped bracket of two boxes, with an overhang in most orientations."""
+    return np.concatenate([box((40., 10., 5.)), box((5., 10., 30.), origin=(35., 0., 5.))])
+
+
+def scan(seed=0):
+    """A bumpy closed surface with a flat base and noisy vertices, like a 3D scan."""
+    theta, phi = np.meshgrid(np.linspace(0, np.pi, 31), np.linspace(0, 2 * np.pi, 61), indexing="ij")
+    points = np.stack([np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta)], axis=-1)
+    points = points * 15 * (1 + 0.2 * np.sin(3 * points[..., :1])) * np.array([1.5, 1., .8])
+    points[..., 2] = np.maximum(points[..., 2], -8)
+    points += np.random.RandomState(seed).normal(scale=0.05, size=points.shape)
+    a, b, c, d = points[:-1, :-1], points[1:, :-1], points[1:, 1:], points[:-1, 1:]
+    return np.concatenate([np.stack([a, b, c], axis=-2), np.stack([a, c, d], axis=-2)], axis=1).reshape(-1, 3, 3)
+
+
+def indexed(vertices):
+    """Returns the unique points and the face_count x 3 indices of the faces."""
+    points, inverse = np.unique(vertices.reshape(-1, 3), axis=0, return_inverse=True)
+    return points, inverse.reshape(-1, 3)
+
+
+CORPUS = {"box": box, "bracket": bracket, "scan": scan}
@@ -0,0 +1,96 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from MeshTweaker import BYTES_PER_PROJECTION, Tweak, TweakCancelled
+from TweakKernels import PARITY_RTOL, NumbaKernels, NumpyKernels
+from corpus import CORPUS, indexed, rotation
+
+# Without numba, the fused kernels run as plain Python, so they are checked on the same meshes with or without it.
+MODES = {"fast": dict(extended_mode=False), "extended": dict(extended_mode=True),
+         "exact_contour": dict(extended_mode=True, exact_contour=True)}
+
+
+def prepare(name, layout, precision, mode, min_volume, **kwargs):
+    """Returns the Tweak, whose parameters are the settings of the kernels, and its preprocessed mesh."""
+    vertices = np.dot(CORPUS[name](), rotation(0).T)
+    content, indices = indexed(vertices) if layout == "indexed" else (vertices.reshape(-1, 3), None)
+    tweak = Tweak(content, indices=indices, verbose=False, min_volume=min_volume, keep_mesh=True,
+                  single_precision=precision == "float32", **dict(MODES[mode], **kwargs))
+    return tweak, tweak.prepared_mesh
+
+
+def orientations(mesh):
+    """The axes, the directions that put faces flat on the plate and random ones."""
+    faces = np.random.RandomState(1).choice(len(mesh), 4, replace=False)
+    random = np.random.RandomState(2).normal(size=(4, 3))
+    return np.vstack([np.eye(3), -np.eye(3), -mesh.normals[faces].astype(np.float64),
+                      random / np.linalg.norm(random, axis=1)[:, None]])
+
+
+@pytest.mark.parametrize("min_volume", [False, True])
+@pytest.mark.parametrize("mode", sorted(MODES))
+@pytest.mark.parametrize("precision", ["float64", "float32"])
+@pytest.mark.parametrize("layout", ["soup", "indexed"])
+@pytest.mark.parametrize("name", sorted(CORPUS))
+def test_fused_kernels_match_the_reference(name, layout, precision, mode, min_volume):
+    tweak, mesh = prepare(name, layout, precision, mode, min_volume)
+    block = orientations(mesh)
+    reference = NumpyKernels.calc_overhang_block(tweak, mesh, block, min_volume)
+    features = NumbaKernels.calc_overhang_block(tweak, mesh, block, min_volume)
+    # float32 meshes are summed in float64 by the fused kernels, but per face in float32 by the reference
+    rtol = PARITY_RTOL if precision == "float64" else 1e-4
+    np.testing.assert_allclose(features, reference, rtol=rtol, atol=1e-9)
+
+
+@pytest.mark.parametrize("min_volume", [False, True])
+@pytest.mark.parametrize("mode", sorted(MODES))
+@pytest.mark.parametrize("layout", ["soup", "indexed"])
+def test_chunked_kernels_match_the_reference(layout, mode, min_volume):
+    # a budget below the projected points of one orientation makes the fused kernels evaluate the faces in chunks
+    tweak, mesh = prepare("scan", layout, "float64", mode, min_volume, memory_budget=4096)
+    block = orientations(mesh)
+    reference = NumpyKernels.calc_overhang_block(tweak, mesh, block, min_volume)
+    for kernels in (NumpyKernels, NumbaKernels):
+        features = kernels.calc_overhang_block(tweak, mesh, block, min_volume, chunk_size=97)
+        np.testing.assert_allclose(features, reference, rtol=PARITY_RTOL, atol=1e-9)
+
+
+class CountdownToken:
+    """Cancellation token that is cancelled after it was checked a number of times."""
+
+    def __init__(self, checks):
+        self.checks = checks
+
+    @property
+    def cancelled(self):
+        self.checks -= 1
+        return self.checks < 0
+
+
+@pytest.mark.parametrize("kernels", [NumpyKernels, NumbaKernels])
+def test_chunked_kernels_can_be_cancelled(kernels):
+    tweak, mesh = prepare("scan", "indexed", "float64", "extended", False, memory_budget=4096)
+    tweak.cancel_token = CountdownToken(3)
+    with pytest.raises(TweakCancelled):
+        kernels.calc_overhang_block(tweak, mesh, orientations(mesh), False, chunk_size=97)
+    assert tweak.cancel_token.checks == -1  # within the first pass over the chunks
+
+
+@pytest.mark.parametrize("min_volume", [False, True])
+@pytest.mark.parametrize("mode", sorted(MODES))
+@pytest.mark.parametrize("layout", ["soup", "indexed"])
+@pytest.mark.parametrize("orientations_per_block", [1, 4])
+def test_lithography_stays_within_the_memory_budget(orientations_per_block, layout, mode, min_volume):
+    tweak, mesh = prepare("scan", layout, "float64", mode, min_volume, backend="numpy")
+    mesh.centroids = mesh.contour_lengths = None  # computed by the lithography like on the first call
+    tweak.memory_budget = orientations_per_block * BYTES_PER_PROJECTION * len(mesh)
+    tracemalloc.start()
+    try:
+        tweak.lithography([[-orientation, 0] for orientation in orientations(mesh)], min_volume, mesh=mesh)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # independent of the mesh size: the buffers of the ufuncs, the results and the arrays of single values
+    assert peak < tweak.memory_budget + 2 ** 17
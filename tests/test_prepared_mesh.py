@@ -0,0 +1,18 @@
+import numpy as np
+
+from MeshTweaker import PreparedMesh, Tweak
+from corpus import bracket
+
+FAVSIDE = "[[1,0,0],3]"
+
+
+def test_favoured_side_matches_the_tweaker():
+    vertices = bracket().reshape(-1, 3)
+    prepared = PreparedMesh(vertices, extended_mode=True)
+    plain, _ = prepared.best()
+    favoured, unprintability = prepared.best(favside=FAVSIDE)
+    tweak = Tweak(vertices, extended_mode=True, verbose=False, favside=FAVSIDE)
+    np.testing.assert_allclose(favoured, tweak.alignment)
+    assert np.isclose(unprintability, tweak.unprintability)
+    # the weighted side changes the choice of the bracket
+    assert not np.allclose(favoured, plain)
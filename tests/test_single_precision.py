@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from MeshTweaker import Tweak
+from corpus import CORPUS, rotation
+
+# Angle in degrees below which two choices are the same orientation, and the relative difference of the unprintability
+# below which a different orientation is an equally good one, e.g. another side of a box
+SAME_ANGLE = 0.01
+TIE_RTOL = 1e-6
+
+# The legacy contour is the edge between the two lowest corners of each touching face. On the flat bottom of a rotated
+# mesh, these are picked by rounding errors, hence float32 may choose an orientation with a different contour.
+LEGACY_CONTOUR_DRIFT = {("bracket", 2, "extended", True)}
+
+MODES = {"fast": dict(extended_mode=False), "extended": dict(extended_mode=True),
+         "exact_contour": dict(extended_mode=True, exact_contour=True)}
+
+
+def choice_regret(vertices, min_volume, **kwargs):
+    """Returns the angle between the float64 and the float32 choice and how much worse the float32 choice is, both
+    scored on the float64 mesh."""
+    double = Tweak(vertices, verbose=False, min_volume=min_volume, keep_mesh=True, **kwargs)
+    single = Tweak(vertices, verbose=False, min_volume=min_volume, single_precision=True, **kwargs)
+    chosen = np.asarray(single.alignment, dtype=np.float64)
+    best = np.asarray(double.alignment, dtype=np.float64)
+    angle = np.degrees(np.arccos(np.clip(np.dot(chosen, best) / np.linalg.norm(chosen) / np.linalg.norm(best), -1, 1)))
+    unprintability = double.lithography([[-chosen, 0]], min_volume, mesh=double.prepared_mesh)[0][4]
+    return angle, (unprintability - double.unprintability) / abs(double.unprintability)
+
+
+@pytest.mark.parametrize("min_volume", [False, True])
+@pytest.mark.parametrize("mode", sorted(MODES))
+@pytest.mark.parametrize("seed", [None, 0, 2])
+@pytest.mark.parametrize("name", sorted(CORPUS))
+def test_single_precision_keeps_the_choice(request, name, seed, mode, min_volume):
+    vertices = CORPUS[name]()
+    if seed is not None:
+        vertices = np.dot(vertices, rotation(seed).T)
+    if (name, seed, mode, min_volume) in LEGACY_CONTOUR_DRIFT:
+        request.applymarker(pytest.mark.xfail(reason="float32 doesn't keep the legacy contour of rotated flat bottoms",
+                                              strict=True))
+    angle, regret = choice_regret(vertices.reshape(-1, 3), min_volume, **MODES[mode])
+    assert angle < SAME_ANGLE or regret < TIE_RTOL
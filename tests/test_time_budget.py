@@ -0,0 +1,26 @@
+import numpy as np
+
+from MeshTweaker import DEADLINE_BLOCK_SIZE, Tweak
+from corpus import CORPUS
+
+
+def test_coarse_to_fine_counts_the_candidates_skipped_on_the_full_mesh(monkeypatch):
+    vertices = CORPUS["scan"]().reshape(-1, 3)
+    coarse_to_fine = Tweak.coarse_to_fine
+
+    def deadline_after_the_coarse_pass(self, *args, **kwargs):
+        # the deadline passes once the first block of the top candidates is scored on the full mesh
+        lithography = self.lithography
+
+        def fine_lithography(orientations, min_volume, mesh=None, **kwargs):
+            if mesh is None:
+                self.deadline = 0
+            return lithography(orientations, min_volume, mesh=mesh, **kwargs)
+        self.lithography = fine_lithography
+        return coarse_to_fine(self, *args, **kwargs)
+
+    monkeypatch.setattr(Tweak, "coarse_to_fine", deadline_after_the_coarse_pass)
+    tweak = Tweak(vertices, extended_mode=True, verbose=False, lod_faces=500, lod_top_k=8, time_budget=np.inf)
+    skipped = 8 - DEADLINE_BLOCK_SIZE
+    assert tweak.lod["fine_skipped"] == skipped
+    assert tweak.candidates_skipped == tweak.stats.candidates_skipped == skipped